@@ -0,0 +1,71 @@
+from sync4s2m.decode import BACKENDS, decode_shikimori_page, decode_myanimelist_page
+from sync4s2m.fake import make_shikimori_rate, make_myanimelist_entry
+
+import argparse
+import json
+import random
+import time
+
+
+def make_pages(size: int, seed: int = 0) -> dict[str, bytes]:
+    rng = random.Random(seed)
+    rates = [make_shikimori_rate(index, "manga", rng) for index in range(1, size + 1)]
+    entries = [make_myanimelist_entry(rate, "manga") for rate in rates]
+    return {
+        "shikimori": json.dumps(rates).encode("UTF-8"),
+        "myanimelist": json.dumps(
+            {"data": entries, "paging": {"next": "https://example.org/next"}}
+        ).encode("UTF-8"),
+    }
+
+
+def decode(site: str, content: bytes, backend: str) -> list:
+    if site == "shikimori":
+        return decode_shikimori_page(content, "manga", backend=backend)
+    return decode_myanimelist_page(content, "manga", backend=backend)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decoding of synthetic list pages into titles with every available backend"
+    )
+    parser.add_argument("-n", "--size", type=int, default=5000, help="entries per page")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("-j", "--json", action="store_true", default=False)
+    args = parser.parse_args()
+
+    report = {}
+    for site, content in make_pages(args.size).items():
+        expected = None
+        report[site] = {"bytes": len(content), "backends": {}}
+        for backend in BACKENDS:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                titles = decode(site, content, backend)
+                times.append(time.perf_counter() - start)
+            # Every backend must give the same titles
+            fingerprints = [(t.get_key(), t.get_fingerprint()) for t in titles]
+            if expected is None:
+                expected = fingerprints
+            elif fingerprints != expected:
+                raise AssertionError(f"{backend} decoded {site} page differently")
+            report[site]["backends"][backend] = {
+                "min": min(times),
+                "titles_per_second": len(titles) / min(times),
+            }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for site, result in report.items():
+        print(f"{site}: {args.size} entries, {result['bytes'] / 1024:.0f} KiB page")
+        baseline = result["backends"]["json"]["min"]
+        for backend, times in result["backends"].items():
+            print(
+                f"{backend:>10}: {times['min'] * 1000:8.2f}ms  "
+                f"{times['titles_per_second']:10.0f} titles/s  x{baseline / times['min']:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from sync4s2m.fake import FakeShikimoriServer, FakeMyAnimeListServer, make_dataset
+from sync4s2m.output import write_json
+from sync4s2m.profiler import Profiler
+from sync4s2m.titlelist import TitleList
+from sync4s2m.tool import Sync4Shikimori2MAL
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+
+def write_config(path: Path, shikimori_url: str, myanimelist_url: str, rate: int, cache: bool):
+    limits = [
+        {"count": rate, "unit": "SECOND", "factor": 1},
+        {"count": rate * 60, "unit": "MINUTE", "factor": 1},
+    ]
+    config = {
+        "shikimori": {
+            "app_name": "benchmark",
+            "client_id": "benchmark",
+            "client_secret": "benchmark",
+            "port": 1,
+            "domain": "one",
+            "api_url": shikimori_url,
+        },
+        "myanimelist": {"client_id": "benchmark", "port": 1, "api_url": myanimelist_url},
+        "rate_limiter": {"shikimori": limits, "myanimelist": limits},
+        "cache": {"max_size_mb": 256 if cache else 0},
+    }
+    with open(path / "config.json", "w") as file:
+        json.dump(config, file, indent=2)
+    token = {
+        "access_token": "benchmark",
+        "refresh_token": "benchmark",
+        "token_type": "Bearer",
+        "expires_at": int(time.time()) + 24 * 3600,
+    }
+    for name in ["shikimori", "myanimelist"]:
+        with open(path / f"{name}.auth.json", "w") as file:
+            json.dump(token, file)
+
+
+def make_logger() -> logging.Logger:
+    # Tool sets up its own logger at INFO only when it is not given one
+    result = logging.getLogger("sync4s2m.benchmark")
+    result.setLevel(logging.WARNING)
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+    result.addHandler(handler)
+    return result
+
+
+def fetch(tool: Sync4Shikimori2MAL, jobs: list[tuple], parallel: bool) -> TitleList:
+    result = TitleList()
+    for part in tool._fetch_(jobs, parallel):
+        result.update(part)
+    return result
+
+
+def get_parse_time(tool: Sync4Shikimori2MAL) -> float:
+    return tool.profiler.stages.get("parse", {"wall": 0.0})["wall"]
+
+
+def run(tool: Sync4Shikimori2MAL, parallel: bool, output) -> dict:
+    result = {}
+    start = time.perf_counter()
+    tool.login()
+    result["login"] = time.perf_counter() - start
+
+    # Pages are decoded as they arrive, the profiler of the tool times decoding apart.
+    # Parallel workers decode at the same time, so there fetch is only a lower bound.
+    parsed = get_parse_time(tool)
+    start = time.perf_counter()
+    shikimori = fetch(tool, tool._shikimori_jobs_(), parallel)
+    myanimelist = fetch(tool, tool._myanimelist_jobs_(), parallel)
+    wall = time.perf_counter() - start
+    result["parse"] = get_parse_time(tool) - parsed
+    result["fetch"] = max(wall - result["parse"], 0.0)
+
+    start = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    tool.snapshots["shikimori"].save(shikimori, now)
+    tool.snapshots["myanimelist"].save(myanimelist, now)
+    result["save"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    delta = shikimori.delta(myanimelist)
+    result["delta"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_json(delta, output)
+    write_json(shikimori, output)
+    result["output"] = time.perf_counter() - start
+
+    result["titles"] = len(shikimori) + len(myanimelist)
+    result["delta_titles"] = len(delta)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark against local fake Shikimori and MyAnimeList servers"
+    )
+    parser.add_argument("-n", "--size", type=int, default=10000, help="titles per list")
+    parser.add_argument("-l", "--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("-r", "--rate", type=int, default=1000, help="requests per second")
+    parser.add_argument("-d", "--drift", type=float, default=0.05, help="fraction of different titles")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-p", "--parallel", action="store_true", default=False)
+    parser.add_argument("--cache", action="store_true", default=False)
+    parser.add_argument("-j", "--json", action="store_true", default=False)
+    args = parser.parse_args()
+
+    shikimori_lists, myanimelist_lists = make_dataset(args.size, args.drift)
+    shikimori = FakeShikimoriServer(
+        shikimori_lists, latency=args.latency, rate=args.rate
+    )
+    myanimelist = FakeMyAnimeListServer(
+        myanimelist_lists, latency=args.latency, rate=args.rate
+    )
+    shikimori.start()
+    myanimelist.start()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        write_config(
+            Path(directory), shikimori.url, myanimelist.url, args.rate, args.cache
+        )
+        tool = Sync4Shikimori2MAL(argparse.Namespace(config=Path(directory)), make_logger())
+        # Set before login, so both API managers report to it
+        tool.profiler = Profiler()
+        with open(os.devnull, "w") as output:
+            for _ in range(args.repeat):
+                runs.append(run(tool, args.parallel, output))
+                tool.shikimori.close()
+                tool.myanimelist.close()
+    shikimori.shutdown()
+    myanimelist.shutdown()
+
+    stages = ["login", "fetch", "parse", "save", "delta", "output"]
+    report = {
+        "size": args.size,
+        "titles": runs[-1]["titles"],
+        "delta_titles": runs[-1]["delta_titles"],
+        "requests": len(shikimori.requests) + len(myanimelist.requests),
+        "stages": {
+            stage: {
+                "min": min(run[stage] for run in runs),
+                "median": statistics.median(run[stage] for run in runs),
+            }
+            for stage in stages
+        },
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(
+        f"{report['titles']} titles, {report['delta_titles']} in delta, "
+        f"{report['requests']} requests in {args.repeat} runs"
+    )
+    for stage, times in report["stages"].items():
+        print(f"{stage:>8}: min {times['min']:8.3f}s  median {times['median']:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import subprocess
+import sys
+
+
+# Modules that only commands talking to the sites may load
+HEAVY_MODULES = [
+    "requests",
+    "authlib",
+    "requests_ratelimiter",
+    "pyrate_limiter",
+    "http.server",
+    "webbrowser",
+    "platformdirs",
+    "sqlite3",
+]
+COMMANDS = {
+    "import": ["-c", "import sync4s2m.__main__"],
+    "version": ["-m", "sync4s2m", "--version"],
+    "template": ["-m", "sync4s2m", "template"],
+}
+
+
+def importtime(args: list[str]) -> dict[str, tuple[int, bool]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = (int(cumulative), not name.startswith("  "))
+    return modules
+
+
+def own_time(modules: dict, baseline: set[str]) -> float:
+    # Nested imports are already counted in cumulative time of top level ones
+    return (
+        sum(
+            cumulative
+            for name, (cumulative, top_level) in modules.items()
+            if top_level and name not in baseline
+        )
+        / 1000
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import time budget of the lightweight CLI paths"
+    )
+    parser.add_argument(
+        "-b", "--budget", type=float, default=15.0, help="budget in milliseconds"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Interpreter startup imports its own modules, they are not ours to pay for
+    baseline = set(importtime(["-c", "pass"]))
+    failed = False
+    for command, command_args in COMMANDS.items():
+        runs = [importtime(command_args) for _ in range(args.repeat)]
+        own = min(own_time(modules, baseline) for modules in runs)
+        heavy = sorted(
+            {
+                name
+                for modules in runs
+                for name in modules
+                if name in HEAVY_MODULES
+            }
+        )
+        ok = own <= args.budget and not heavy
+        failed = failed or not ok
+        print(
+            f"{command:>8}: {own:6.2f}ms of {args.budget:g}ms budget"
+            + (f", heavy imports: {', '.join(heavy)}" if heavy else "")
+            + ("" if ok else "  FAILED")
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+from sync4s2m.titlelist import (
+    Title,
+    TitleList,
+    MODIFY_UNMODIFIED,
+    WATCH,
+    parse_shikimori,
+)
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+
+class LegacyTitle(object):
+    # Layout of Title before __slots__: instance dict, raw payload and eager delta JSON
+    def __init__(
+        self, type_: str, raw_title: dict, parse_func, delta: dict = {}, keep_raw: bool = True
+    ):
+        self._type_ = type_
+        self._modify_type_ = MODIFY_UNMODIFIED
+        self._delta_ = json.dumps(delta)
+        self._raw_ = raw_title if keep_raw else None
+        parse_func(self, raw_title)
+
+    def get_type(self) -> str:
+        return self._type_
+
+
+def make_page(count: int) -> str:
+    return json.dumps(
+        [
+            {
+                "id": 100000 + i,
+                "score": i % 11,
+                "status": WATCH[i % len(WATCH)],
+                "rewatches": i % 3,
+                "episodes": i % 24,
+                "volumes": None,
+                "chapters": None,
+                "text": "" if i % 5 else f"comment {i}",
+                "text_html": "",
+                "created_at": "2020-01-01T00:00:00.000+03:00",
+                "updated_at": "2024-01-01T00:00:00.000+03:00",
+                "user": {"id": 1, "nickname": "user"},
+                "anime": {
+                    "id": i + 1,
+                    "name": f"Anime title {i}",
+                    "russian": f"Аниме {i}",
+                    "image": {"original": f"/system/animes/original/{i}.jpg"},
+                    "url": f"/animes/{i + 1}",
+                    "kind": "tv",
+                    "score": "7.5",
+                    "status": "released",
+                    "episodes": 24,
+                    "episodes_aired": 0,
+                    "aired_on": "2020-01-01",
+                    "released_on": "2020-06-01",
+                },
+            }
+            for i in range(count)
+        ]
+    )
+
+
+def measure(build, page: str) -> tuple[int, object]:
+    gc.collect()
+    tracemalloc.start()
+    result = build(json.loads(page))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory usage of parsed title lists")
+    parser.add_argument("-n", "--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    page = make_page(args.count)
+    # Both layouts go into the same plain list with the same raw handling,
+    # so rows differ only by the title class, and the last one by the container
+    results = {}
+    for keep_raw in [True, False]:
+        suffix = " (keep_raw)" if keep_raw else ""
+        results[f"legacy{suffix}"] = lambda raws, keep_raw=keep_raw: [
+            LegacyTitle("anime", raw, parse_shikimori, keep_raw=keep_raw) for raw in raws
+        ]
+        results[f"title{suffix}"] = lambda raws, keep_raw=keep_raw: [
+            Title("anime", raw_title=raw, parse_func=parse_shikimori, keep_raw=keep_raw)
+            for raw in raws
+        ]
+    results["title in TitleList"] = lambda raws: TitleList(
+        Title("anime", raw_title=raw, parse_func=parse_shikimori, keep_raw=False)
+        for raw in raws
+    )
+    for name, build in results.items():
+        size, result = measure(build, page)
+        print(
+            f"{name:>18}: {size / 1024 / 1024:8.2f} MiB, {size / args.count:7.1f} B/title"
+        )
+        del result
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 from sync4s2m import __version__
-from sync4s2m.tool import Sync4Shikimori2MAL
 from pathlib import Path
 
-import requests
 import sys
 import argparse
 import textwrap
@@ -31,6 +29,32 @@ def handle_args():
         default=False,
         help="Wrap output lines into json array",
     )
+    parser.add_argument(
+        "-n",
+        "--ndjson",
+        action="store_true",
+        default=False,
+        help="stream one json object per line instead of a json array",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="print json report with per-stage timings and requests to stderr",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        type=Path,
+        help="directory for cProfile dumps of profiled stages, requires --profile; "
+        "a stage started inside or next to another one is not dumped, "
+        "and worker threads of --parallel runs are not profiled",
+    )
+    parser.add_argument(
+        "--keep-raw",
+        action="store_true",
+        default=False,
+        help="keep raw API payloads in parsed titles",
+    )
 
     command_parser = parser.add_subparsers(
         help="list of commands", dest="command", required=True, metavar="command"
@@ -45,6 +69,86 @@ def handle_args():
         help="Site of your list: shikimori and myanimelist",
         metavar="source",
     )
+    list_parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        default=False,
+        help="fetch anime and manga lists concurrently",
+    )
+    list_parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="fetch only titles changed since the last saved snapshot",
+    )
+    list_parser.add_argument(
+        "-f",
+        "--file",
+        type=Path,
+        help="read list from site export file (.json or .xml, optionally .gz) instead of API",
+    )
+    list_parser.add_argument(
+        "-m",
+        "--max-age",
+        type=float,
+        default=0,
+        help="show list saved by earlier fetch if it is not older than this many seconds",
+    )
+    list_parser.add_argument(
+        "--type",
+        action="append",
+        choices=["anime", "manga", "ranobe"],
+        help="only titles of this type, can be repeated",
+    )
+    list_parser.add_argument(
+        "--status",
+        action="append",
+        choices=["planned", "watching", "completed", "rewatching", "on_hold", "dropped"],
+        help="only titles with this watch status, can be repeated",
+    )
+    list_parser.add_argument(
+        "--id", type=int, action="append", help="only title with this id, can be repeated"
+    )
+
+    query_parser = command_parser.add_parser(
+        "query", help="filter and sort list saved by earlier fetch without network"
+    )
+    query_parser.add_argument(
+        "source",
+        choices=["shikimori", "myanimelist"],
+        help="Site of your list: shikimori and myanimelist",
+        metavar="source",
+    )
+    query_parser.add_argument(
+        "--type",
+        action="append",
+        choices=["anime", "manga", "ranobe"],
+        help="only titles of this type, can be repeated",
+    )
+    query_parser.add_argument(
+        "--status",
+        action="append",
+        choices=["planned", "watching", "completed", "rewatching", "on_hold", "dropped"],
+        help="only titles with this watch status, can be repeated",
+    )
+    query_parser.add_argument("--min-score", type=int, help="only titles scored at least this")
+    query_parser.add_argument("--name", type=str, help="only titles with this text in name")
+    query_parser.add_argument(
+        "-s",
+        "--sort",
+        choices=["id", "name", "score", "updated_at", "episodes", "chapters", "volumes"],
+        help="sort titles by this field",
+    )
+    query_parser.add_argument(
+        "-d",
+        "--desc",
+        action="store_true",
+        default=False,
+        help="sort in descending order",
+    )
+    query_parser.add_argument("-l", "--limit", type=int, help="show at most this many titles")
 
     format_parser = command_parser.add_parser(
         "template", help="show formatting names for uni lists"
@@ -60,6 +164,188 @@ def handle_args():
         default=False,
         help="use myanimelist as source instead of shikimori",
     )
+    delta_parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        default=False,
+        help="fetch anime and manga lists from both sites concurrently",
+    )
+    delta_parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="fetch only titles changed since the last saved snapshots",
+    )
+    delta_parser.add_argument(
+        "--shikimori-file",
+        type=Path,
+        help="read shikimori list from export file (.json or .xml, optionally .gz) instead of API",
+    )
+    delta_parser.add_argument(
+        "--myanimelist-file",
+        type=Path,
+        help="read myanimelist list from export file (.xml, optionally .gz) instead of API",
+    )
+    delta_parser.add_argument(
+        "--type",
+        action="append",
+        choices=["anime", "manga", "ranobe"],
+        help="only titles of this type, can be repeated",
+    )
+    delta_parser.add_argument(
+        "--status",
+        action="append",
+        choices=["planned", "watching", "completed", "rewatching", "on_hold", "dropped"],
+        help="only titles with this watch status, can be repeated",
+    )
+    delta_parser.add_argument(
+        "--id", type=int, action="append", help="only title with this id, can be repeated"
+    )
+    delta_parser.add_argument(
+        "--modify",
+        action="append",
+        choices=["added", "edited", "removed"],
+        help="only titles with this kind of change, can be repeated",
+    )
+
+    commit_parser = command_parser.add_parser(
+        "commit", help="push delta from shikimori to myanimelist"
+    )
+    commit_parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        default=False,
+        help="fetch anime and manga lists from both sites concurrently",
+    )
+    commit_parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="fetch only titles changed since the last saved snapshots",
+    )
+    commit_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="number of concurrent write requests, 4 for default",
+    )
+
+    plan_parser = command_parser.add_parser(
+        "plan", help="show requests commit would send and how long it would take"
+    )
+    plan_parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        default=False,
+        help="fetch anime and manga lists from both sites concurrently",
+    )
+    plan_parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="fetch only titles changed since the last saved snapshots",
+    )
+    plan_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="number of concurrent write requests to plan for, 4 for default",
+    )
+
+    watch_parser = command_parser.add_parser(
+        "watch", help="keep checking both sites and show new delta entries"
+    )
+    watch_parser.add_argument(
+        "-r",
+        "--reverse",
+        action="store_true",
+        default=False,
+        help="use myanimelist as source instead of shikimori",
+    )
+    watch_parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        default=False,
+        help="fetch anime and manga lists from both sites concurrently",
+    )
+    watch_parser.add_argument(
+        "-I",
+        "--interval",
+        type=float,
+        default=300.0,
+        help="seconds between checks, 300 for default",
+    )
+    watch_parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.1,
+        help="random fraction added to or taken from interval, 0.1 for default",
+    )
+    watch_parser.add_argument(
+        "--max-backoff",
+        type=float,
+        default=3600.0,
+        help="max seconds between checks after failures, 3600 for default",
+    )
+    watch_parser.add_argument(
+        "--full-every",
+        type=int,
+        default=12,
+        help="fetch full lists every N checks instead of changes only, 0 for always",
+    )
+
+    batch_parser = command_parser.add_parser(
+        "batch",
+        help="show delta or commit for every account from manifest in one shared rate budget",
+    )
+    batch_parser.add_argument(
+        "manifest",
+        type=Path,
+        help="json file with rate_limiter block and accounts list of name, config and source",
+    )
+    batch_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="number of accounts processed at once, 4 for default",
+    )
+    batch_parser.add_argument(
+        "-p",
+        "--parallel",
+        action="store_true",
+        default=False,
+        help="fetch anime and manga lists from both sites concurrently",
+    )
+    batch_parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="fetch only titles changed since the last saved snapshots",
+    )
+    batch_parser.add_argument(
+        "-C",
+        "--commit",
+        action="store_true",
+        default=False,
+        help="push delta to myanimelist instead of showing it",
+    )
+    batch_parser.add_argument(
+        "--commit-workers",
+        type=int,
+        default=4,
+        help="number of concurrent write requests per account, 4 for default",
+    )
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(1)
@@ -84,6 +370,7 @@ def template():
         {rewatches} - count of rewatches
         {comment} - comment or empty string
         {delta} - difference of same title entry in json format on both sites or empty object
+        * edited titles have [source, target] value pairs for every changed field
 
         Title fields:
         {id} - id (used in title url and API)
@@ -93,42 +380,200 @@ def template():
     print(out)
 
 
+def write_result(args, result) -> int:
+    from sync4s2m.output import write_json, write_ndjson, write_template
+
+    if args.template:
+        return write_template(result, args.template, sys.stdout)
+    elif args.ndjson:
+        return write_ndjson(result, sys.stdout)
+    return write_json(result, sys.stdout)
+
+
+def print_result(tool, args, result):
+    count = 0
+    # Result may be a lazy iterator, so titles are counted while written
+    with tool._stage_("output", lambda: count):
+        count = write_result(args, result)
+    if tool.profiler:
+        print(json.dumps(tool.profiler.report(), indent=2), file=sys.stderr)
+
+
+def get_title_filter(args):
+    from sync4s2m.titlelist import TitleFilter
+
+    return TitleFilter(
+        types=args.type,
+        statuses=args.status,
+        modify=getattr(args, "modify", None),
+        ids=args.id,
+    )
+
+
 def get_list(args):
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
+    setattr(args, f"{args.source}_file", args.file)
     tool = Sync4Shikimori2MAL(args)
-    if args.source == "shikimori":
-        tool.shikimori.login()
-        result = tool.get_shikimori_list()
+    title_filter = get_title_filter(args)
+    # Plain fetch can be streamed right into the output, but no snapshot is saved then
+    stream = args.ndjson and (args.file or not (args.parallel or args.incremental))
+    result = None
+    if args.max_age and not args.file:
+        result = tool.get_stored_list(args.source, args.max_age)
+    if result is not None:
+        pass
+    elif args.source == "shikimori":
+        if not args.file:
+            tool.shikimori.login()
+        if stream:
+            result = tool.iter_shikimori_list(tool._pushdown_(title_filter, False))
+        else:
+            result = tool.get_shikimori_list(
+                args.parallel, args.incremental, title_filter
+            )
     elif args.source == "myanimelist":
-        tool.myanimelist.login()
-        result = tool.get_myanimelist_list()
+        if not args.file:
+            tool.myanimelist.login()
+        if stream:
+            result = tool.iter_myanimelist_list(tool._pushdown_(title_filter, False))
+        else:
+            result = tool.get_myanimelist_list(
+                args.parallel, args.incremental, title_filter
+            )
     else:
         raise NotImplemented(f"{args.source} not supported")
-    if args.template:
-        result.print_list(args.template)
-    else:
-        print(json.dumps(result.to_list()))
+    # Ids and whatever the site can't filter are checked here
+    if title_filter and stream:
+        result = (title for title in result if title_filter.match(title))
+    elif title_filter:
+        result = result.filter(title_filter)
+    print_result(tool, args, result)
+
+
+def query(args):
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
+    tool = Sync4Shikimori2MAL(args)
+    if tool.store.get_age(args.source) is None:
+        tool.logger.error(f"No saved {args.source} list, fetch it with list command first")
+        sys.exit(1)
+    result = tool.store.query(
+        args.source,
+        types=args.type,
+        statuses=args.status,
+        min_score=args.min_score,
+        name=args.name,
+        sort=args.sort,
+        descending=args.desc,
+        limit=args.limit,
+    )
+    print_result(tool, args, result)
 
 
 def get_delta(args):
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
     tool = Sync4Shikimori2MAL(args)
     tool.login()
-    result = tool.get_delta(source="myanimelist") if args.reverse else tool.get_delta()
-    if args.template:
-        result.print_list(args.template)
-    else:
-        print(json.dumps(result.to_list()))
+    result = (tool.iter_delta if args.ndjson else tool.get_delta)(
+        source="myanimelist" if args.reverse else "shikimori",
+        parallel=args.parallel,
+        incremental=args.incremental,
+        title_filter=get_title_filter(args),
+    )
+    print_result(tool, args, result)
+
+
+def commit(args):
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
+    tool = Sync4Shikimori2MAL(args)
+    tool.login()
+    _, failed = tool.commit(args.parallel, args.incremental, args.workers)
+    if tool.profiler:
+        print(json.dumps(tool.profiler.report(), indent=2), file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def plan(args):
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
+    tool = Sync4Shikimori2MAL(args)
+    tool.login()
+    print(json.dumps(tool.plan(args.parallel, args.incremental, args.workers), indent=2))
+    if tool.profiler:
+        print(json.dumps(tool.profiler.report(), indent=2), file=sys.stderr)
+
+
+def watch(args):
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
+    tool = Sync4Shikimori2MAL(args)
+
+    def on_delta(delta):
+        with tool._stage_("output", len(delta)):
+            write_result(args, delta)
+
+    try:
+        tool.watch(
+            on_delta,
+            source="myanimelist" if args.reverse else "shikimori",
+            interval=args.interval,
+            jitter=args.jitter,
+            max_backoff=args.max_backoff,
+            full_every=args.full_every,
+            parallel=args.parallel,
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tool.logout()
+        if tool.profiler:
+            print(json.dumps(tool.profiler.report(), indent=2), file=sys.stderr)
+
+
+def batch(args):
+    from sync4s2m.batch import BatchScheduler
+    from sync4s2m.tool import Sync4Shikimori2MAL
+
+    logger = Sync4Shikimori2MAL(args).logger
+    scheduler = BatchScheduler(
+        logger,
+        args.manifest,
+        workers=args.workers,
+        parallel=args.parallel,
+        incremental=args.incremental,
+        commit=args.commit,
+        commit_workers=args.commit_workers,
+    )
+    results = scheduler.run()
+    print(json.dumps(results))
+    if any(result["status"] != "ok" for result in results.values()):
+        sys.exit(1)
 
 
 def main():
     args = handle_args()
     if args.command == "template":
-        template(args)
+        template()
     elif args.command == "list":
         get_list(args)
+    elif args.command == "query":
+        query(args)
     elif args.command == "delta":
         get_delta(args)
+    elif args.command == "commit":
+        commit(args)
+    elif args.command == "plan":
+        plan(args)
+    elif args.command == "watch":
+        watch(args)
+    elif args.command == "batch":
+        batch(args)
     else:
-        ValueError(f"Unknown command {args.command}")
+        raise ValueError(f"Unknown command {args.command}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from logging import Logger
+from pathlib import Path
+from pyrate_limiter import Limiter
+from sync4s2m.auth import APIManager, ShikimoriAPIManager, MyAnimeListAPIManager
+from sync4s2m.config import Config
+from sync4s2m.limiter import LIMIT_STATUSES, LimiterState, get_retry_after
+from sync4s2m.tokens import TOKEN_LEEWAY, TokenStore
+from urllib.parse import urlparse
+
+import asyncio
+import time
+
+try:
+    from authlib.integrations.httpx_client import AsyncOAuth2Client
+    import httpx
+except ImportError:
+    AsyncOAuth2Client = None
+    httpx = None
+
+
+if AsyncOAuth2Client:
+
+    class AsyncOAuth2ClientWithTokenStore(AsyncOAuth2Client):
+        """Refreshes the token under the token file lock, like OAuth2SessionWithURLPrefix"""
+
+        def __init__(self, *args, token_store: TokenStore, io, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.token_store = token_store
+            self.io = io
+            self.__refresh__ = asyncio.Lock()
+
+        async def ensure_active_token(self, token=None):
+            if not self.token.is_expired(leeway=self.leeway):
+                return
+            async with self.__refresh__:
+                # Lock is taken and released on the file thread, so it can be held across awaits
+                await self.io(self.token_store.lock.acquire)
+                try:
+                    # Only one worker refreshes, the others take its token from the store
+                    stored = await self.io(self.token_store.load)
+                    if stored and stored.get("access_token") != self.token.get("access_token"):
+                        self.token = stored
+                    if self.token.is_expired(leeway=self.leeway):
+                        await super().ensure_active_token(self.token)
+                finally:
+                    await self.io(self.token_store.lock.release)
+
+
+class AsyncAdaptiveLimiter(object):
+    """Budget and 429 slowdown of AdaptiveLimiterAdapter for coroutines"""
+
+    def __init__(
+        self,
+        logger: Logger,
+        limiter: Limiter,
+        path: Path,
+        name: str,
+        retries: int = 3,
+        max_slowdown: float = 16.0,
+        recovery: float = 0.9,
+    ):
+        self.logger = logger
+        self.limiter = limiter
+        self.name = name
+        self.retries = retries
+        self.max_slowdown = max_slowdown
+        self.recovery = recovery
+        self.state = LimiterState(path, name)
+        self.on_wait = None
+
+    def _get_delay_(self) -> float:
+        blocked_until, slowdown = self.state.get()
+        rate = self.limiter._rates[0]
+        delay = max(blocked_until - time.time(), 0.0)
+        return delay + (slowdown - 1.0) * rate.interval / rate.limit
+
+    def _acquire_(self, bucket: str):
+        # Fair gate and SQLite bucket are the ones of the sync clients, both block,
+        # so a waiting request holds a worker thread instead of the event loop
+        with self.limiter.ratelimit(bucket, delay=True):
+            pass
+
+    def _fill_(self, bucket: str):
+        # Same catch up as LimiterMixin._fill_bucket, under the lock of the bucket
+        bucket = self.limiter.bucket_group[bucket]
+        bucket.lock_acquire()
+        try:
+            now = self.limiter.time_function()
+            rate = self.limiter._rates[0]
+            count, _ = bucket.inspect_expired_items(now - rate.interval)
+            for _ in range(rate.limit - count):
+                bucket.put(now)
+        finally:
+            bucket.lock_release()
+
+    async def send(self, url: str, send) -> "httpx.Response":
+        # Bucket is named by host like in requests-ratelimiter, so sync and async
+        # clients of one site share it
+        bucket = urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            delay = await asyncio.to_thread(self._get_delay_)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await asyncio.to_thread(self._acquire_, bucket)
+            if self.on_wait:
+                self.on_wait(time.perf_counter() - started)
+            response = await send()
+            if response.status_code not in LIMIT_STATUSES:
+                await asyncio.to_thread(self.state.recover, self.recovery)
+                return response
+            await asyncio.to_thread(self._fill_, bucket)
+            _, slowdown = await asyncio.to_thread(self.state.get)
+            delay = get_retry_after(response)
+            if delay is None:
+                rate = self.limiter._rates[0]
+                delay = slowdown * rate.interval
+            slowdown = await asyncio.to_thread(
+                self.state.penalize, delay, self.max_slowdown
+            )
+            self.logger.warning(
+                f"Rate limit of {self.name} exceeded, waiting {delay:.1f}s with slowdown x{slowdown:g}"
+            )
+            if attempt < self.retries:
+                await response.aclose()
+        return response
+
+
+class AsyncAPIManager(object):
+    def __init__(
+        self,
+        manager: APIManager,
+        headers: dict = {},
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+    ):
+        if AsyncOAuth2Client is None:
+            raise ImportError(
+                "Async API managers require httpx, install sync4shikimori2myanimelist[async]"
+            )
+        # Sync manager keeps the interactive login, it is rare and waits for a browser
+        self.manager = manager
+        self.logger = manager.logger
+        self.config = manager.config
+        self.name = manager.name
+        self.prefix_url = manager.prefix_url
+        self.tokens = manager.tokens
+        self.headers = headers
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+        )
+        self.__client__ = None
+        self.__limiter__ = None
+        self.__io__ = None
+        self.whoami = None
+        self.profiler = None
+
+    async def _io_(self, func, *args):
+        # Token files and their lock live on one thread: the lock is reentrant per
+        # thread, so a refresh can save the token while it holds the lock
+        if not self.__io__:
+            self.__io__ = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"{self.name}-io"
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            self.__io__, partial(func, *args)
+        )
+
+    async def _on_token_refresh_(self, token, **kwargs):
+        self.logger.info(f"Token of {self.name} refreshed")
+        await self._io_(self.tokens.save, dict(token))
+
+    def _init_limiter_(self) -> AsyncAdaptiveLimiter:
+        result = AsyncAdaptiveLimiter(
+            self.logger,
+            self.config.get_limiter(self.name),
+            self.config.get_limiter_path(),
+            self.name,
+        )
+        if self.profiler:
+            result.on_wait = lambda seconds: self.profiler.on_limiter_wait(
+                self.name, seconds
+            )
+        return result
+
+    async def _open_(self) -> "AsyncOAuth2ClientWithTokenStore":
+        if not self.__client__:
+            token = await self._io_(self.tokens.load)
+            limiter = await asyncio.to_thread(self._init_limiter_)
+            # Another request may have opened the client while this one waited
+            if not self.__client__:
+                self.logger.info(f"Creating async session for {self.name}...")
+                self.__limiter__ = limiter
+                self.__client__ = AsyncOAuth2ClientWithTokenStore(
+                    client_id=self.manager.client_id,
+                    client_secret=self.manager.client_secret,
+                    token_endpoint=self.manager.token_uri,
+                    scope=self.manager.scope,
+                    token=token if token else None,
+                    update_token=self._on_token_refresh_,
+                    leeway=TOKEN_LEEWAY,
+                    headers=self.headers,
+                    limits=self.limits,
+                    token_store=self.tokens,
+                    io=self._io_,
+                )
+        return self.__client__
+
+    async def login(self):
+        if not await self._io_(self.tokens.load):
+            await asyncio.to_thread(self.manager.login)
+            self.manager.close()
+        else:
+            self.logger.info(f"Found saved token for {self.name}")
+        self.whoami = await self._io_(self.tokens.get_whoami)
+        if not self.whoami:
+            self.whoami = await self._whoami_()
+            await self._io_(self.tokens.save_whoami, self.whoami)
+
+    async def request(self, method: str, url: str, **kwargs) -> "httpx.Response":
+        client = await self._open_()
+        if url.startswith("/"):
+            url = f"{self.prefix_url}{url}"
+        response = await self.__limiter__.send(
+            url, lambda: client.request(method, url, **kwargs)
+        )
+        if self.profiler:
+            self.profiler.on_response(response)
+        return response
+
+    async def get(self, url: str, **kwargs) -> "httpx.Response":
+        return await self.request("GET", url, **kwargs)
+
+    async def patch(self, url: str, **kwargs) -> "httpx.Response":
+        return await self.request("PATCH", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> "httpx.Response":
+        return await self.request("DELETE", url, **kwargs)
+
+    async def close(self):
+        if self.__client__:
+            await self.__client__.aclose()
+            self.__client__ = None
+        if self.__io__:
+            self.__io__.shutdown(wait=False)
+            self.__io__ = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _whoami_(self):
+        raise NotImplementedError()
+
+
+class AsyncShikimoriAPIManager(AsyncAPIManager):
+    def __init__(self, logger: Logger, config: Config, **kwargs):
+        super().__init__(
+            ShikimoriAPIManager(logger, config),
+            headers={"User-Agent": config.get("shikimori.app_name")},
+            **kwargs,
+        )
+
+    async def login(self):
+        await super().login()
+        self.logger.info(f"Shikimori authorized as {self.whoami['nickname']}")
+
+    async def _whoami_(self):
+        response = await self.get("/users/whoami")
+        response.raise_for_status()
+        return response.json()
+
+
+class AsyncMyAnimeListAPIManager(AsyncAPIManager):
+    def __init__(self, logger: Logger, config: Config, **kwargs):
+        super().__init__(MyAnimeListAPIManager(logger, config), **kwargs)
+
+    async def login(self):
+        await super().login()
+        self.logger.info(f"MyAnimeList authorized as {self.whoami['name']}")
+
+    async def _whoami_(self):
+        response = await self.get("/users/@me")
+        response.raise_for_status()
+        return response.json()
@@ -1,43 +1,43 @@
 from pathlib import Path
-from http.server import BaseHTTPRequestHandler, HTTPServer
 from authlib.integrations.requests_client import OAuth2Session
 from authlib.common.security import generate_token
-from requests_ratelimiter import LimiterAdapter
 from logging import Logger
+from hashlib import sha256
+from urllib3.util.request import ACCEPT_ENCODING
 from sync4s2m.config import Config
+from sync4s2m.cache import CachedLimiterAdapter
+from sync4s2m.paginator import (
+    Paginator,
+    PageCheckpoint,
+    PagePaginator,
+    OffsetPaginator,
+    PREFETCH_PAGES,
+    CHECKPOINT_TTL,
+)
+from sync4s2m.tokens import TokenStore, TOKEN_LEEWAY
 
-
-import webbrowser
-import requests
 import json
 
 
-class OAuthHTTPHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header("Content-Type", "text/html")
-        self.end_headers()
-        self.wfile.write(
-            '<html><head><script type="application/javascript">window.close();</script><head><body>Authorized, you can close this page now.<body><html>'.encode(
-                "UTF-8"
-            )
-        )
-        self.server.result = self.path
-
-    def log_message(self, format, *args):
-        pass  # NO, GOD! PLEASE! NO!
-
-
-class OAuthHTTPServer(HTTPServer):
-    def __init__(self, port: int):
-        super().__init__(("localhost", port), OAuthHTTPHandler)
-        self.result = None
-
-
 class OAuth2SessionWithURLPrefix(OAuth2Session):
-    def __init__(self, prefix: str, *args, **kwargs):
+    def __init__(self, prefix: str, *args, token_store: TokenStore = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.prefix = prefix
+        self.token_store = token_store
+
+    def ensure_active_token(self, token=None):
+        if token is None:
+            token = self.token
+        if self.token_store is None or not token.is_expired(leeway=self.leeway):
+            return super().ensure_active_token(token)
+        # Only one worker refreshes, the others take its token from the store
+        with self.token_store.lock:
+            stored = self.token_store.load()
+            if stored and stored.get("access_token") != token.get("access_token"):
+                self.token = stored
+                if not self.token.is_expired(leeway=self.leeway):
+                    return True
+            return super().ensure_active_token(self.token)
 
     def request(self, method, url, withhold_token=False, auth=None, **kwargs):
         if url.startswith("/"):
@@ -84,6 +84,7 @@ class APIManager(object):
         prefix_url: str,
         session_class=OAuth2SessionWithURLPrefix,
         session_kwargs: dict = {},
+        paginator_class=PagePaginator,
     ):
         self.logger = logger
         self.config = config
@@ -98,8 +99,15 @@ class APIManager(object):
         self.__session_class__ = session_class
         self.__session_kwargs__ = session_kwargs
         self.__session__ = None
+        self.__paginator_class__ = paginator_class
+        self.prefetch = self.config.get(f"{name}.prefetch", False) or PREFETCH_PAGES
+        self.checkpoint_ttl = self.config.get(f"{name}.checkpoint_ttl", False)
+        if self.checkpoint_ttl is None:
+            self.checkpoint_ttl = CHECKPOINT_TTL
+        self.tokens = TokenStore(logger, config, name)
         self.whoami = None
         self.state = None
+        self.profiler = None
         self.use_pkce = (
             session_kwargs["code_challenge_method"]
             if "code_challenge_method" in session_kwargs
@@ -111,21 +119,18 @@ class APIManager(object):
         self.save_token()
 
     def load_token(self) -> dict:
-        path = self.config.get_config_dir(True) / f"{self.name}.auth.json"
-        if path.is_file():
-            with open(path, "r") as file:
-                return json.load(file)
-        return {}
+        return self.tokens.load()
 
     def save_token(self):
-        with open(
-            self.config.get_config_dir(True) / f"{self.name}.auth.json", "w"
-        ) as file:
-            json.dump(self.client.token, file, indent=2)
-            self.logger.info(f"Saved token for {self.name} rewritten")
+        self.tokens.save(self.client.token)
+        self.logger.info(f"Saved token for {self.name} rewritten")
 
     def login(self):
         if not self.client.token:
+            # Interactive login is rare, so its modules are loaded only here
+            from sync4s2m.callback import OAuthHTTPServer
+            import webbrowser
+
             self.logger.info(f"No saved token for {self.name} found, try to login...")
             with OAuthHTTPServer(self.port) as httpd:
                 code_verifier = generate_token(128)
@@ -154,9 +159,19 @@ class APIManager(object):
                     authorization_response=httpd.result, **extra_kwargs
                 )
                 self.save_token()
+                # New login may be another account
+                self.tokens.clear_whoami()
         else:
             self.logger.info(f"Found saved token for {self.name}")
-        self.whoami = self._whoami_()
+        self.whoami = self.tokens.get_whoami()
+        if not self.whoami:
+            self.whoami = self._whoami_()
+            self.tokens.save_whoami(self.whoami)
+
+    def close(self):
+        if self.__session__:
+            self.__session__.close()
+            self.__session__ = None
 
     def refresh_token(self):
         self.logger.info(f"Force token update for {self.name}")
@@ -176,15 +191,43 @@ class APIManager(object):
                 token=token if token else None,
                 redirect_uri=f"http://localhost:{self.port}/",
                 update_token=self._on_token_refresh_,
+                leeway=TOKEN_LEEWAY,
+                token_store=self.tokens,
                 state=self.state,
                 prefix=self.prefix_url,
                 **self.__session_kwargs__,
             )
-            adapter = LimiterAdapter(limiter=self.config.get_limiter(self.name))
+            adapter = CachedLimiterAdapter(
+                self.logger,
+                self.config.get_limiter_path(),
+                self.name,
+                limiter=self.config.get_limiter(self.name),
+                cache=self.config.get_cache(),
+            )
+            # Requests already asks for gzip and deflate, urllib3 adds br when brotli is installed
+            self.__session__.headers["Accept-Encoding"] = ACCEPT_ENCODING
             self.__session__.mount("https://", adapter)
             self.__session__.mount("http://", adapter)
+            if self.profiler:
+                self.profiler.attach(self.name, self.__session__, adapter)
         return self.__session__
 
+    def paginate(self, url: str, params: dict, decode, limit: int) -> Paginator:
+        checkpoint = None
+        # Zero time to live turns checkpoints off
+        if self.checkpoint_ttl:
+            source = f"{url}?{json.dumps(params, sort_keys=True)}&limit={limit}"
+            checkpoint = PageCheckpoint(
+                self.config.get_config_dir(True)
+                / "pages"
+                / f"{self.name}-{sha256(source.encode()).hexdigest()[:16]}",
+                source,
+                self.checkpoint_ttl,
+            )
+        return self.__paginator_class__(
+            self, url, params, decode, limit, self.prefetch, checkpoint
+        )
+
     def _whoami_(self):
         raise NotImplementedError()
 
@@ -198,7 +241,8 @@ class ShikimoriAPIManager(APIManager):
             f"https://shikimori.{config.get('shikimori.domain')}/oauth/authorize",
             f"https://shikimori.{config.get('shikimori.domain')}/oauth/token",
             ["user_rates"],
-            f"https://shikimori.{config.get('shikimori.domain')}/api",
+            config.get("shikimori.api_url", False)
+            or f"https://shikimori.{config.get('shikimori.domain')}/api",
             OAuth2SessionWithUserAgent,
             {"user_agent": config.get("shikimori.app_name")},
         )
@@ -220,8 +264,10 @@ class MyAnimeListAPIManager(APIManager):
             f"https://myanimelist.net/v1/oauth2/authorize",
             f"https://myanimelist.net/v1/oauth2/token",
             ["write:users"],
-            "https://api.myanimelist.net/v2",
+            config.get("myanimelist.api_url", False)
+            or "https://api.myanimelist.net/v2",
             session_kwargs={"code_challenge_method": "plain"},
+            paginator_class=OffsetPaginator,
         )
 
     def login(self):
@@ -0,0 +1,127 @@
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging import Logger, LoggerAdapter
+from pathlib import Path
+from sync4s2m.config import Config
+from sync4s2m.limiter import FairGate
+from sync4s2m.tool import Sync4Shikimori2MAL
+
+import json
+import time
+
+
+SITES = ["shikimori", "myanimelist"]
+
+
+class AccountLogger(LoggerAdapter):
+    def process(self, msg, kwargs):
+        return f"[{self.extra['account']}] {msg}", kwargs
+
+
+class BatchScheduler(object):
+    def __init__(
+        self,
+        logger: Logger,
+        manifest: Path,
+        workers: int = 4,
+        parallel: bool = False,
+        incremental: bool = False,
+        commit: bool = False,
+        commit_workers: int = 4,
+    ):
+        self.logger = logger
+        self.manifest = Path(manifest)
+        self.workers = workers
+        self.parallel = parallel
+        self.incremental = incremental
+        self.commit = commit
+        self.commit_workers = commit_workers
+        self.accounts = []
+        self.rates = {}
+        self.gates = {site: FairGate() for site in SITES}
+
+    def load(self):
+        with open(self.manifest, "r") as file:
+            data = json.load(file)
+        # Rates of the manifest are the budget of all accounts together
+        defaults = Config(self.logger, Namespace(config=None)).get("rate_limiter")
+        rates = data.get("rate_limiter", {})
+        self.rates = {site: rates.get(site) or defaults[site] for site in SITES}
+        self.accounts = []
+        for account in data["accounts"]:
+            config = Path(account["config"])
+            if not config.is_absolute():
+                config = self.manifest.parent / config
+            self.accounts.append(
+                {
+                    "name": account["name"],
+                    "config": config,
+                    "source": account.get("source", "shikimori"),
+                }
+            )
+        names = [account["name"] for account in self.accounts]
+        if len(set(names)) != len(names):
+            raise ValueError("Account names in manifest must be unique")
+        self.logger.info(f"Loaded manifest with {len(self.accounts)} accounts")
+
+    def _init_tool_(self, account: dict) -> Sync4Shikimori2MAL:
+        args = Namespace(
+            config=account["config"],
+            shared_limiter={
+                "path": self.manifest.parent / "ratelimit.sqlite",
+                "rates": self.rates,
+                "gates": self.gates,
+                "account": account["name"],
+            },
+        )
+        logger = AccountLogger(self.logger, {"account": account["name"]})
+        return Sync4Shikimori2MAL(args, logger)
+
+    def _run_account_(self, account: dict) -> dict:
+        # Nobody answers config prompts in batch, so broken accounts fail early
+        if not (account["config"] / "config.json").is_file():
+            raise FileNotFoundError(f"No config.json in {account['config']}")
+        tool = self._init_tool_(account)
+        started = time.perf_counter()
+        try:
+            tool.login()
+            if self.commit:
+                done, failed = tool.commit(
+                    self.parallel, self.incremental, self.commit_workers
+                )
+                result = {
+                    "status": "failed" if failed else "ok",
+                    "done": done,
+                    "failed": failed,
+                }
+            else:
+                delta = tool.get_delta(
+                    account["source"], self.parallel, self.incremental
+                )
+                result = {"status": "ok", "delta": delta.to_list()}
+        finally:
+            tool.logout()
+        result["elapsed"] = time.perf_counter() - started
+        return result
+
+    def run(self) -> dict[str, dict]:
+        if not self.accounts:
+            self.load()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self._run_account_, account): account["name"]
+                for account in self.accounts
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                # One broken account must not stop the others
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    self.logger.exception(f"Sync of {name} failed: {e}")
+                    results[name] = {"status": "error", "error": str(e)}
+                self.logger.info(
+                    f"[{len(results)}/{len(futures)}] {name}: {results[name]['status']}"
+                )
+        return {account["name"]: results[account["name"]] for account in self.accounts}
@@ -0,0 +1,146 @@
+from hashlib import sha1
+from pathlib import Path
+from threading import Lock
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from sync4s2m.limiter import AdaptiveLimiterAdapter
+
+import json
+import sqlite3
+import time
+
+
+class ResponseCache(object):
+    def __init__(self, path: Path, max_size: int):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.__lock__ = Lock()
+        self.__connection__ = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not self.__connection__:
+            self.__connection__ = sqlite3.connect(
+                str(self.path), check_same_thread=False, timeout=30
+            )
+            self.__connection__.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, "
+                "etag TEXT, last_modified TEXT, headers TEXT, body BLOB, size INTEGER, used REAL)"
+            )
+            self.__connection__.execute(
+                "CREATE INDEX IF NOT EXISTS responses_used ON responses (used)"
+            )
+        return self.__connection__
+
+    @staticmethod
+    def key(method: str, url: str) -> str:
+        return sha1(f"{method} {url}".encode("UTF-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self.__lock__:
+            row = self.connection.execute(
+                "SELECT etag, last_modified, headers, body FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if not row:
+                return None
+            self.connection.execute(
+                "UPDATE responses SET used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.connection.commit()
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "headers": json.loads(row[2]),
+            "body": row[3],
+        }
+
+    def put(self, key: str, url: str, headers: dict, body: bytes):
+        if len(body) > self.max_size:
+            return
+        # Body is stored decoded, so transfer headers of the original response are stale
+        headers = {
+            name: value
+            for name, value in headers.items()
+            if name.lower() not in ("content-encoding", "content-length")
+        }
+        with self.__lock__:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    url,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    json.dumps(headers),
+                    body,
+                    len(body),
+                    time.time(),
+                ),
+            )
+            self._evict_()
+            self.connection.commit()
+
+    def _evict_(self):
+        total = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_size:
+            return
+        evicted = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY used"
+        ).fetchall():
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self):
+        with self.__lock__:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+
+
+class CacheMixin(object):
+    def __init__(self, *args, cache: ResponseCache = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+
+    def _build_cached_response_(self, request, entry: dict) -> Response:
+        response = Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = "utf-8"
+        response._content = entry["body"]
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
+
+    def send(self, request, **kwargs):
+        if not self.cache or request.method != "GET":
+            return super().send(request, **kwargs)
+        key = self.cache.key(request.method, request.url)
+        entry = self.cache.get(key)
+        if entry:
+            if entry["etag"]:
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+        response = super().send(request, **kwargs)
+        if response.status_code == 304 and entry:
+            response.close()
+            return self._build_cached_response_(request, entry)
+        if response.status_code == 200 and (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        ):
+            self.cache.put(key, request.url, response.headers, response.content)
+        return response
+
+
+class CachedLimiterAdapter(CacheMixin, AdaptiveLimiterAdapter):
+    pass
@@ -0,0 +1,23 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class OAuthHTTPHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write(
+            '<html><head><script type="application/javascript">window.close();</script><head><body>Authorized, you can close this page now.<body><html>'.encode(
+                "UTF-8"
+            )
+        )
+        self.server.result = self.path
+
+    def log_message(self, format, *args):
+        pass  # NO, GOD! PLEASE! NO!
+
+
+class OAuthHTTPServer(HTTPServer):
+    def __init__(self, port: int):
+        super().__init__(("localhost", port), OAuthHTTPHandler)
+        self.result = None
@@ -0,0 +1,289 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from logging import Logger
+from threading import Lock
+from sync4s2m.auth import APIManager
+from sync4s2m.config import Config
+from sync4s2m.limiter import TRANSIENT_STATUSES, get_retry_after
+from sync4s2m.titlelist import (
+    Title,
+    TitleList,
+    WATCH_PLANNED,
+    WATCH_WATCHING,
+    WATCH_REWATCHING,
+    parse_snapshot,
+)
+from typing import Iterable
+
+import time
+import requests
+
+
+MAL_ANIME_STATUS = {
+    WATCH_PLANNED: "plan_to_watch",
+    WATCH_REWATCHING: "watching",
+}
+MAL_MANGA_STATUS = {
+    WATCH_PLANNED: "plan_to_read",
+    WATCH_WATCHING: "reading",
+    WATCH_REWATCHING: "reading",
+}
+# Mean time of one MyAnimeList write when the limiter does not hold it
+REQUEST_LATENCY = 0.3
+
+
+def myanimelist_path(title: Title) -> str:
+    kind = "anime" if title.is_anime() else "manga"
+    return f"/{kind}/{title.get_id()}/my_list_status"
+
+
+def myanimelist_fields(title: Title) -> dict:
+    status = title.get_watch_status()
+    if title.is_anime():
+        return {
+            "status": MAL_ANIME_STATUS.get(status, status),
+            "is_rewatching": str(title.is_rewatching()).lower(),
+            "score": title.get_score(),
+            "num_watched_episodes": title.get_episodes(),
+            "num_times_rewatched": title.get_rewatches(),
+            "comments": title.get_comment(),
+        }
+    return {
+        "status": MAL_MANGA_STATUS.get(status, status),
+        "is_rereading": str(title.is_rewatching()).lower(),
+        "score": title.get_score(),
+        "num_volumes_read": title.get_volumes(),
+        "num_chapters_read": title.get_chapters(),
+        "num_times_reread": title.get_rewatches(),
+        "comments": title.get_comment(),
+    }
+
+
+def myanimelist_previous(title: Title) -> Title:
+    # Edited titles keep values of the other site as the second items of their delta
+    raw = title.to_snapshot()
+    raw.update({key: values[1] for key, values in title.get_delta_dict().items()})
+    return Title(
+        title.get_type(), raw_title=raw, parse_func=parse_snapshot, keep_raw=False
+    )
+
+
+def estimate_wall_time(
+    requests: int,
+    rates: list[tuple[int, int]],
+    workers: int,
+    latency: float = REQUEST_LATENCY,
+) -> float:
+    if not requests:
+        return 0.0
+    # Every rate lets its count of requests in a window, the last window is not waited out
+    limited = max(((requests - 1) // count) * interval for count, interval in rates)
+    return max(limited + latency, -(-requests // workers) * latency)
+
+
+class Write(object):
+    def __init__(self, method: str, title: Title, data: dict):
+        self.method = method
+        self.path = myanimelist_path(title)
+        self.kind = "anime" if title.is_anime() else "manga"
+        self.id = title.get_id()
+        self.data = data
+        self.titles = [title]
+
+    def merge(self, method: str, title: Title, data: dict):
+        # Update creates missing entry, so it wins over removal of the same one
+        if method == "PATCH":
+            self.data = {**self.data, **data} if self.method == "PATCH" else data
+            self.method = method
+        self.titles.append(title)
+
+    def get_order(self) -> tuple:
+        return (self.method, self.kind, self.id)
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "data": self.data,
+            "titles": [
+                f"{title.get_modify_type()} {title.get_type()} {title.get_id()}"
+                for title in self.titles
+            ],
+        }
+
+
+class CommitPlan(object):
+    def __init__(self, titles: Iterable[Title], done: int = 0):
+        self.titles = 0
+        self.done = done
+        self.skipped = 0
+        writes = {}
+        for title in titles:
+            self.titles += 1
+            if title.is_removed():
+                method, data = "DELETE", {}
+            else:
+                method, data = "PATCH", myanimelist_fields(title)
+            if title.is_edited():
+                previous = myanimelist_fields(myanimelist_previous(title))
+                data = {key: value for key, value in data.items() if previous[key] != value}
+                # Names and fields of other title types are not written to MyAnimeList
+                if not data:
+                    self.skipped += 1
+                    continue
+            path = myanimelist_path(title)
+            if path in writes:
+                writes[path].merge(method, title, data)
+            else:
+                writes[path] = Write(method, title, data)
+        self.writes = sorted(writes.values(), key=Write.get_order)
+
+    def __len__(self) -> int:
+        return len(self.writes)
+
+    def get_merged(self) -> int:
+        return self.titles - self.skipped - len(self.writes)
+
+    def report(self, rates: list[tuple[int, int]], workers: int) -> dict:
+        methods = {}
+        for write in self.writes:
+            methods[write.method] = methods.get(write.method, 0) + 1
+        return {
+            "titles": self.titles,
+            "done": self.done,
+            "skipped": self.skipped,
+            "merged": self.get_merged(),
+            "requests": len(self.writes),
+            "methods": methods,
+            "wall_time": estimate_wall_time(len(self.writes), rates, workers),
+            "writes": [write.to_dict() for write in self.writes],
+        }
+
+
+class Journal(object):
+    def __init__(self, logger: Logger, config: Config, name: str):
+        self.logger = logger
+        self.config = config
+        self.name = name
+        self.__lock__ = Lock()
+        self.__done__ = set()
+
+    @property
+    def path(self):
+        return self.config.get_config_dir(True) / f"{self.name}.journal"
+
+    @staticmethod
+    def key(title: Title) -> str:
+        # Built-in hash of strings is salted per process, so journal keeps its own digest
+        digest = blake2b(
+            repr(title.get_compared_fields()).encode("UTF-8"), digest_size=8
+        ).hexdigest()
+        return f"{title.get_modify_type()}:{title.get_type()}:{title.get_id()}:{digest}"
+
+    def load(self):
+        if self.path.is_file():
+            with open(self.path, "r") as file:
+                self.__done__ = {line.strip() for line in file if line.strip()}
+            self.logger.info(
+                f"Found unfinished commit of {self.name} with {len(self.__done__)} done requests"
+            )
+
+    def __contains__(self, title: Title) -> bool:
+        return self.key(title) in self.__done__
+
+    def mark(self, title: Title):
+        key = self.key(title)
+        with self.__lock__:
+            self.__done__.add(key)
+            with open(self.path, "a") as file:
+                file.write(key + "\n")
+
+    def clear(self):
+        self.__done__ = set()
+        self.path.unlink(missing_ok=True)
+
+
+class CommitEngine(object):
+    def __init__(
+        self,
+        logger: Logger,
+        config: Config,
+        api: APIManager,
+        workers: int = 4,
+        retries: int = 5,
+        backoff: float = 1.0,
+    ):
+        self.logger = logger
+        self.config = config
+        self.api = api
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.journal = Journal(logger, config, api.name)
+        self.deleted: list[tuple[str, int]] = []
+
+    def _request_(self, write: Write) -> requests.Response:
+        if write.method == "DELETE":
+            return self.api.client.delete(write.path)
+        return self.api.client.patch(write.path, data=write.data)
+
+    def _send_(self, write: Write) -> bool:
+        name = f"{write.method} {write.kind} {write.id}"
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2**attempt
+            try:
+                response = self._request_(write)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.logger.warning(f"Request for {name} failed: {e}")
+            else:
+                if response.ok or write.method == "DELETE" and response.status_code == 404:
+                    for title in write.titles:
+                        self.journal.mark(title)
+                    if write.method == "DELETE":
+                        self.deleted.append((write.kind, write.id))
+                    return True
+                if response.status_code not in TRANSIENT_STATUSES:
+                    self.logger.error(
+                        f"Request for {name} rejected with {response.status_code}: {response.text}"
+                    )
+                    return False
+                delay = max(delay, get_retry_after(response) or 0.0)
+                self.logger.warning(
+                    f"Request for {name} failed with {response.status_code}"
+                )
+            if attempt < self.retries:
+                time.sleep(delay)
+        self.logger.error(f"Giving up on {name} after {self.retries + 1} attempts")
+        return False
+
+    def plan(self, titles: TitleList) -> CommitPlan:
+        self.journal.load()
+        changed = [
+            title
+            for title in titles
+            if title.is_added() or title.is_edited() or title.is_removed()
+        ]
+        pending = [title for title in changed if title not in self.journal]
+        return CommitPlan(pending, len(changed) - len(pending))
+
+    def commit(self, titles: TitleList) -> tuple[int, int]:
+        plan = self.plan(titles)
+        wall_time = estimate_wall_time(
+            len(plan), self.config.get_rates(self.api.name), self.workers
+        )
+        self.logger.info(
+            f"Committing {len(plan)} requests for {plan.titles} of {len(titles)} titles "
+            f"to {self.api.name}, about {wall_time:.0f}s..."
+        )
+        # Session is created lazily, so create it here instead of racing in workers
+        self.api.client
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self._send_, plan.writes))
+        done = results.count(True)
+        failed = results.count(False)
+        if not failed:
+            self.journal.clear()
+        self.logger.info(
+            f"Commit to {self.api.name} finished: {done} done, {failed} failed"
+        )
+        return done, failed
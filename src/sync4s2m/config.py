@@ -1,9 +1,13 @@
 from pathlib import Path
-from pyrate_limiter import Duration, RequestRate, Limiter
+from typing import TYPE_CHECKING
 
 import os
+import time
 import json
-import platformdirs
+
+if TYPE_CHECKING:
+    from pyrate_limiter import Limiter
+    from sync4s2m.cache import ResponseCache
 
 
 ENV_HOME_PATH = "SYNC4S2M_HOME"
@@ -31,8 +35,12 @@ class Config(object):
                     {"count": 90, "unit": "MINUTE", "factor": 1},
                 ],
             },
+            "cache": {"max_size_mb": 64},
         }
         self.arg_dir = args.config
+        # Batch runs share one limiter and its rates between all accounts
+        self.shared_limiter = getattr(args, "shared_limiter", None)
+        self.__cache__ = None
 
     def get_config_dir(self, create: bool = False) -> Path:
         if self.arg_dir:
@@ -46,6 +54,8 @@ class Config(object):
                 result.mkdir(parents=True, exist_ok=True)
             return result
         else:
+            import platformdirs
+
             return Path(
                 platformdirs.user_config_dir(
                     appname="sync4s2m", appauthor="MJaroslav", ensure_exists=create
@@ -106,6 +116,12 @@ class Config(object):
                 {"count": 90, "unit": "MINUTE", "factor": 1},
             ]
             result = True
+        if not "cache" in self.__values__:
+            self.__values__["cache"] = {}
+        cache = self.__values__["cache"]
+        if not "max_size_mb" in cache or cache["max_size_mb"] < 0:
+            cache["max_size_mb"] = 64
+            result = True
         return result
 
     def get(self, key: str, do_raise=True) -> any:
@@ -119,15 +135,53 @@ class Config(object):
                 return None
         return result
 
-    def get_limiter(self, name: str) -> Limiter:
-        params = self.get(f"rate_limiter.{name}")
-        rates = [
-            RequestRate(
-                param["count"], getattr(Duration, param["unit"]) * param["factor"]
-            )
+    def get_rates(self, name: str) -> list[tuple[int, int]]:
+        from pyrate_limiter import Duration
+
+        if self.shared_limiter:
+            params = self.shared_limiter["rates"][name]
+        else:
+            params = self.get(f"rate_limiter.{name}")
+        return [
+            (param["count"], getattr(Duration, param["unit"]) * param["factor"])
             for param in params
         ]
-        return Limiter(*rates)
+
+    def get_limiter(self, name: str) -> "Limiter":
+        from pyrate_limiter import RequestRate, Limiter
+        from sync4s2m.limiter import FairLimiter, SharedSQLiteBucket
+
+        rates = [RequestRate(count, interval) for count, interval in self.get_rates(name)]
+        kwargs = {
+            "bucket_class": SharedSQLiteBucket,
+            "bucket_kwargs": {"path": self.get_limiter_path()},
+            "time_function": time.time,
+        }
+        if self.shared_limiter:
+            return FairLimiter(
+                *rates,
+                gate=self.shared_limiter["gates"][name],
+                account=self.shared_limiter["account"],
+                **kwargs,
+            )
+        return Limiter(*rates, **kwargs)
+
+    def get_limiter_path(self) -> Path:
+        if self.shared_limiter:
+            return Path(self.shared_limiter["path"])
+        return self.get_config_dir(True) / "ratelimit.sqlite"
+
+    def get_cache(self) -> "ResponseCache | None":
+        from sync4s2m.cache import ResponseCache
+
+        max_size = self.get("cache.max_size_mb")
+        if not max_size:
+            return None
+        if not self.__cache__:
+            self.__cache__ = ResponseCache(
+                self.get_config_dir(True) / "cache.sqlite", max_size * 1024 * 1024
+            )
+        return self.__cache__
 
     def load(self):
         self.logger.info("Configuration loading...")
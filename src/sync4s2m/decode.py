@@ -0,0 +1,196 @@
+from sync4s2m.titlelist import (
+    Title,
+    WATCH,
+    TYPE_RANOBE,
+    myanimelist_status,
+    parse_shikimori,
+    parse_myanimelist,
+)
+from functools import partial
+from typing import Annotated, Literal
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+BACKENDS = ["json"] + (["orjson"] if orjson else []) + (["msgspec"] if msgspec else [])
+# Fastest first, as measured by benchmarks/decode.py. Without msgspec, orjson
+# turned out slower than json on Shikimori pages on some machines, so it is
+# used only for MyAnimeList.
+PREFERRED_BACKENDS = {
+    "shikimori": ["msgspec", "json"],
+    "myanimelist": ["msgspec", "orjson", "json"],
+}
+
+
+def get_backend(site: str) -> str:
+    return next(backend for backend in PREFERRED_BACKENDS[site] if backend in BACKENDS)
+
+
+def shikimori_type(kind: str, url: str) -> str:
+    return TYPE_RANOBE if kind == "manga" and "/ranobe/" in url else kind
+
+
+if msgspec:
+    Id = Annotated[int, msgspec.Meta(ge=1)]
+    Count = Annotated[int, msgspec.Meta(ge=0)]
+    Score = Annotated[int, msgspec.Meta(ge=0, le=10)]
+
+    class ShikimoriTarget(msgspec.Struct):
+        id: Id
+        name: str
+        url: str = ""
+
+    # Constraints repeat Title.validate, so decoded titles are not validated again
+    class ShikimoriRate(msgspec.Struct):
+        status: Literal[tuple(WATCH)]
+        score: Score = 0
+        episodes: Count | None = None
+        chapters: Count | None = None
+        volumes: Count | None = None
+        rewatches: Count = 0
+        text: str | None = None
+        updated_at: str | None = None
+        anime: ShikimoriTarget | None = None
+        manga: ShikimoriTarget | None = None
+
+    class MyAnimeListNode(msgspec.Struct):
+        id: Id
+        title: str
+
+    class MyAnimeListStatus(msgspec.Struct):
+        status: Literal[
+            "watching",
+            "reading",
+            "completed",
+            "on_hold",
+            "dropped",
+            "plan_to_watch",
+            "plan_to_read",
+        ]
+        score: Score = 0
+        num_episodes_watched: Count = 0
+        num_chapters_read: Count = 0
+        num_volumes_read: Count = 0
+        is_rewatching: bool = False
+        is_rereading: bool = False
+        num_times_rewatched: Count = 0
+        num_times_reread: Count = 0
+        comments: str | None = None
+        updated_at: str | None = None
+
+    class MyAnimeListEntry(msgspec.Struct):
+        node: MyAnimeListNode
+        list_status: MyAnimeListStatus
+
+    class MyAnimeListPaging(msgspec.Struct):
+        next: str | None = None
+
+    class MyAnimeListPage(msgspec.Struct):
+        data: list[MyAnimeListEntry]
+        paging: MyAnimeListPaging = msgspec.field(default_factory=MyAnimeListPaging)
+
+    _shikimori_decoder_ = msgspec.json.Decoder(list[ShikimoriRate])
+    _myanimelist_decoder_ = msgspec.json.Decoder(MyAnimeListPage)
+
+
+def shikimori_target(rate: "ShikimoriRate", kind: str) -> "ShikimoriTarget":
+    target = getattr(rate, kind)
+    # Both targets are optional in the struct, so a rate without one passes decoding
+    if target is None:
+        raise ValueError(f"Title {rate} not validated: no {kind}")
+    return target
+
+
+def parse_shikimori_rate(self: Title, rate: "ShikimoriRate", target: "ShikimoriTarget"):
+    self._id_ = target.id
+    self._name_ = target.name
+    self._watch_status_ = rate.status
+    self._episodes_ = rate.episodes or 0
+    self._chapters_ = rate.chapters or 0
+    self._volumes_ = rate.volumes or 0
+    self._score_ = rate.score
+    self._comment_ = rate.text or ""
+    self._rewatches_ = rate.rewatches
+    self._updated_at_ = rate.updated_at or ""
+
+
+def parse_myanimelist_entry(self: Title, entry: "MyAnimeListEntry"):
+    list_status = entry.list_status
+    self._id_ = entry.node.id
+    self._name_ = entry.node.title
+    self._watch_status_ = myanimelist_status(
+        list_status.status, list_status.is_rewatching or list_status.is_rereading
+    )
+    self._episodes_ = list_status.num_episodes_watched
+    self._chapters_ = list_status.num_chapters_read
+    self._volumes_ = list_status.num_volumes_read
+    self._score_ = list_status.score
+    self._comment_ = list_status.comments or ""
+    self._rewatches_ = list_status.num_times_rewatched or list_status.num_times_reread
+    self._updated_at_ = list_status.updated_at or ""
+
+
+def decode_shikimori_page(
+    content: bytes, kind: str, keep_raw: bool = False, backend: str = None
+) -> list[Title]:
+    backend = backend or get_backend("shikimori")
+    # Raw payload is kept as API dict, typed structs can't give it
+    if backend == "msgspec" and not keep_raw:
+        result = []
+        for rate in _shikimori_decoder_.decode(content):
+            target = shikimori_target(rate, kind)
+            result.append(
+                Title(
+                    shikimori_type(kind, target.url),
+                    raw_title=rate,
+                    parse_func=partial(parse_shikimori_rate, target=target),
+                    keep_raw=False,
+                    validate=False,
+                )
+            )
+        return result
+    page = orjson.loads(content) if orjson and backend != "json" else json.loads(content)
+    return [
+        Title(
+            shikimori_type(kind, e[kind]["url"]),
+            raw_title=e,
+            parse_func=parse_shikimori,
+            keep_raw=keep_raw,
+        )
+        for e in page
+    ]
+
+
+def decode_myanimelist_page(
+    content: bytes, kind: str, keep_raw: bool = False, backend: str = None
+) -> tuple[list[Title], bool]:
+    backend = backend or get_backend("myanimelist")
+    if backend == "msgspec" and not keep_raw:
+        page = _myanimelist_decoder_.decode(content)
+        titles = [
+            Title(
+                kind,
+                raw_title=entry,
+                parse_func=parse_myanimelist_entry,
+                keep_raw=False,
+                validate=False,
+            )
+            for entry in page.data
+        ]
+        return titles, page.paging.next is not None
+    page = orjson.loads(content) if orjson and backend != "json" else json.loads(content)
+    titles = [
+        Title(kind, raw_title=e, parse_func=parse_myanimelist, keep_raw=keep_raw)
+        for e in page["data"]
+    ]
+    return titles, "next" in page["paging"]
@@ -0,0 +1,154 @@
+from pathlib import Path
+from sync4s2m.titlelist import Title, parse_shikimori, parse_myanimelist
+from typing import Iterator, TextIO
+from xml.etree.ElementTree import iterparse
+
+import gzip
+import json
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Shikimori exports its lists in the same XML format as MyAnimeList
+XML_FIELDS = {
+    "anime": {
+        "id": "series_animedb_id",
+        "title": "series_title",
+        "num_episodes_watched": "my_watched_episodes",
+        "num_times_rewatched": "my_times_watched",
+        "is_rewatching": "my_rewatching",
+    },
+    "manga": {
+        "id": "manga_mangadb_id",
+        "title": "manga_title",
+        "num_volumes_read": "my_read_volumes",
+        "num_chapters_read": "my_read_chapters",
+        "num_times_reread": "my_times_read",
+        "is_rereading": "my_rereading",
+    },
+}
+
+
+def open_export(path: Path, mode: str = "rt"):
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, mode, encoding="utf-8" if "t" in mode else None)
+    return open(path, mode, **({"encoding": "utf-8"} if "t" in mode else {}))
+
+
+def export_format(path: Path) -> str:
+    path = Path(path)
+    suffix = path.with_suffix("").suffix if path.suffix == ".gz" else path.suffix
+    if suffix not in (".json", ".xml"):
+        raise ValueError(f"Unknown export format of {path}, json or xml expected")
+    return suffix[1:]
+
+
+def iter_json_array(stream: TextIO) -> Iterator[dict]:
+    # Only one element and one chunk are in memory at once
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != "[":
+                raise ValueError("Export file is not a json array")
+            buffer = buffer[1:]
+            started = True
+            continue
+        if started and buffer[:1] == ",":
+            buffer = buffer[1:]
+            continue
+        if started and buffer[:1] == "]":
+            return
+        if started and buffer:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # Number at the chunk end may be cut, so decode it only with its end
+                if end < len(buffer) or eof:
+                    yield value
+                    buffer = buffer[end:]
+                    continue
+        if eof:
+            raise ValueError("Export file ended before its json array")
+        chunk = stream.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer += chunk
+
+
+def _xml_status_(value: str) -> str:
+    # Plan to Watch, On-Hold and others are named like in API after this
+    return value.strip().lower().replace("-", "_").replace(" ", "_")
+
+
+def _xml_int_(element, tag: str) -> int:
+    value = element.findtext(tag)
+    return int(value) if value and value.strip().isdigit() else 0
+
+
+def iter_xml_export(path: Path, keep_raw: bool = False) -> Iterator[Title]:
+    with open_export(path, "rb") as file:
+        root = None
+        for event, element in iterparse(file, events=("start", "end")):
+            if root is None:
+                root = element
+            if event != "end" or element.tag not in XML_FIELDS:
+                continue
+            kind = element.tag
+            fields = XML_FIELDS[kind]
+            list_status = {
+                "status": _xml_status_(element.findtext("my_status") or ""),
+                "score": _xml_int_(element, "my_score"),
+                "comments": element.findtext("my_comments") or "",
+            }
+            for field, tag in fields.items():
+                if field in ("id", "title"):
+                    continue
+                list_status[field] = _xml_int_(element, tag)
+            raw = {
+                "node": {
+                    "id": _xml_int_(element, fields["id"]),
+                    "title": element.findtext(fields["title"]) or "",
+                },
+                "list_status": list_status,
+            }
+            yield Title(
+                kind, raw_title=raw, parse_func=parse_myanimelist, keep_raw=keep_raw
+            )
+            # Parsed entries are dropped from the tree to keep memory constant
+            root.clear()
+
+
+def iter_shikimori_json_export(path: Path, keep_raw: bool = False) -> Iterator[Title]:
+    with open_export(path) as file:
+        for entry in iter_json_array(file):
+            target_type = entry["target_type"].lower()
+            kind = "ranobe" if target_type == "ranobe" else target_type
+            raw = {
+                "manga" if kind == "ranobe" else kind: {
+                    "id": entry["target_id"],
+                    "name": entry.get("target_title") or "",
+                },
+                "status": entry["status"],
+                "episodes": entry.get("episodes"),
+                "chapters": entry.get("chapters"),
+                "volumes": entry.get("volumes"),
+                "score": entry.get("score") or 0,
+                "text": entry.get("text"),
+                "rewatches": entry.get("rewatches") or 0,
+            }
+            yield Title(
+                kind, raw_title=raw, parse_func=parse_shikimori, keep_raw=keep_raw
+            )
+
+
+def iter_export(path: Path, keep_raw: bool = False) -> Iterator[Title]:
+    if export_format(path) == "json":
+        return iter_shikimori_json_export(path, keep_raw)
+    return iter_xml_export(path, keep_raw)
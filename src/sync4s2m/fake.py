@@ -0,0 +1,319 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse, urlencode
+
+import gzip
+import json
+import random
+import re
+import time
+
+
+SHIKIMORI_RATES_PATH = re.compile(r"^/api/users/(\d+)/(anime|manga)_rates$")
+SHIKIMORI_HISTORY_PATH = re.compile(r"^/api/users/(\d+)/history$")
+MAL_LIST_PATH = re.compile(r"^/v2/users/@me/(anime|manga)list$")
+MAL_LIST_STATUS_PATH = re.compile(r"^/v2/(anime|manga)/(\d+)/my_list_status$")
+MAL_TOKEN_PATH = "/v1/oauth2/token"
+
+SHIKIMORI_STATUSES = [
+    "planned",
+    "watching",
+    "rewatching",
+    "completed",
+    "on_hold",
+    "dropped",
+]
+MAL_STATUSES = {
+    "anime": {"planned": "plan_to_watch", "rewatching": "watching"},
+    "manga": {"planned": "plan_to_read", "watching": "reading", "rewatching": "reading"},
+}
+
+
+def make_shikimori_rate(index: int, kind: str, rng: random.Random) -> dict:
+    ranobe = kind == "manga" and index % 4 == 0
+    episodes = rng.randint(0, 24) if kind == "anime" else 0
+    chapters = rng.randint(0, 200) if kind == "manga" else 0
+    return {
+        "id": 1000000 + index,
+        "score": rng.randint(0, 10),
+        "status": rng.choice(SHIKIMORI_STATUSES),
+        "text": f"comment {index}" if rng.random() < 0.1 else None,
+        "text_html": "",
+        "episodes": episodes,
+        "chapters": chapters,
+        "volumes": chapters // 10,
+        "rewatches": rng.randint(0, 2),
+        "created_at": "2020-01-01T00:00:00.000+03:00",
+        "updated_at": f"2024-01-01T00:00:{index % 60:02d}.000+03:00",
+        "user": {"id": 1, "nickname": "fake"},
+        kind: {
+            "id": index,
+            "name": f"{kind.capitalize()} title {index}",
+            "russian": f"Название {index}",
+            "url": f"/{'ranobe' if ranobe else kind + 's'}/{index}",
+            "kind": "light_novel" if ranobe else "tv" if kind == "anime" else "manga",
+            "score": "7.5",
+            "status": "released",
+        },
+    }
+
+
+def make_myanimelist_entry(rate: dict, kind: str) -> dict:
+    status = rate["status"]
+    list_status = {
+        "status": MAL_STATUSES[kind].get(status, status),
+        "score": rate["score"],
+        "updated_at": "2024-01-01T00:00:00+00:00",
+        "comments": rate["text"] or "",
+    }
+    if kind == "anime":
+        list_status["num_episodes_watched"] = rate["episodes"]
+        list_status["is_rewatching"] = status == "rewatching"
+        list_status["num_times_rewatched"] = rate["rewatches"]
+    else:
+        list_status["num_chapters_read"] = rate["chapters"]
+        list_status["num_volumes_read"] = rate["volumes"]
+        list_status["is_rereading"] = status == "rewatching"
+        list_status["num_times_reread"] = rate["rewatches"]
+    return {
+        "node": {"id": rate[kind]["id"], "title": rate[kind]["name"]},
+        "list_status": list_status,
+    }
+
+
+def make_dataset(size: int, drift: float = 0.05, seed: int = 0) -> tuple[dict, dict]:
+    rng = random.Random(seed)
+    shikimori = {"anime": [], "manga": []}
+    myanimelist = {"anime": [], "manga": []}
+    for index in range(1, size + 1):
+        kind = "anime" if index % 3 else "manga"
+        rate = make_shikimori_rate(index, kind, rng)
+        chance = rng.random()
+        if chance < drift / 3:
+            # Title only in the source list
+            shikimori[kind].append(rate)
+            continue
+        entry = make_myanimelist_entry(rate, kind)
+        if chance < drift * 2 / 3:
+            entry["list_status"]["score"] = (rate["score"] + 1) % 11
+        elif chance < drift:
+            # Title only in the target list
+            myanimelist[kind].append(entry)
+            continue
+        shikimori[kind].append(rate)
+        myanimelist[kind].append(entry)
+    return shikimori, myanimelist
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply_(self, code: int, data=None, headers: dict = {}):
+        body = json.dumps(data).encode("UTF-8") if data is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        if len(body) >= 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, 6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_(self, method: str):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("UTF-8") if length else ""
+        form = {key: values[-1] for key, values in parse_qs(body).items()}
+        self._reply_(*self.server.dispatch(method, url.path, query, form))
+
+    def do_GET(self):
+        self._handle_("GET")
+
+    def do_PATCH(self):
+        self._handle_("PATCH")
+
+    def do_DELETE(self):
+        self._handle_("DELETE")
+
+    def do_POST(self):
+        self._handle_("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    prefix = ""
+
+    def __init__(self, port: int = 0, latency: float = 0.0, rate: float = 0.0):
+        super().__init__(("localhost", port), FakeHandler)
+        self.latency = latency
+        self.rate = rate
+        self.lock = Lock()
+        self.requests = []
+        self.__calls__ = deque()
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.server_port}{self.prefix}"
+
+    def _limited_(self) -> bool:
+        if not self.rate:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.__calls__ and self.__calls__[0] < now - 1.0:
+                self.__calls__.popleft()
+            if len(self.__calls__) >= self.rate:
+                return True
+            self.__calls__.append(now)
+        return False
+
+    def dispatch(self, method: str, path: str, query: dict, form: dict) -> tuple:
+        if self.latency:
+            time.sleep(self.latency)
+        if self._limited_():
+            return 429, {"error": "too_many_requests"}, {"Retry-After": "1"}
+        with self.lock:
+            self.requests.append((method, path))
+        return self.route(method, path, query, form)
+
+    def route(self, method: str, path: str, query: dict, form: dict) -> tuple:
+        raise NotImplementedError()
+
+    def start(self) -> Thread:
+        thread = Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class FakeShikimoriServer(FakeServer):
+    prefix = "/api"
+
+    def __init__(self, lists: dict = None, user_id: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.user_id = user_id
+        self.lists = lists if lists is not None else {"anime": [], "manga": []}
+
+    def route(self, method: str, path: str, query: dict, form: dict) -> tuple:
+        if method != "GET":
+            return 405, {"error": "method_not_allowed"}
+        if path == "/api/users/whoami":
+            return 200, {"id": self.user_id, "nickname": "fake"}
+        match = SHIKIMORI_RATES_PATH.match(path)
+        if match and int(match.group(1)) == self.user_id:
+            rates = self.lists[match.group(2)]
+            if "status" in query:
+                rates = [rate for rate in rates if rate["status"] == query["status"]]
+            limit = int(query.get("limit", 5000))
+            start = (int(query.get("page", 1)) - 1) * limit
+            # Shikimori returns one extra rate when there is a next page
+            return 200, rates[start : start + limit + 1]
+        if SHIKIMORI_HISTORY_PATH.match(path):
+            return 200, []
+        if path == "/api/v2/user_rates":
+            kind = query.get("target_type", "Anime").lower()
+            target_id = int(query.get("target_id", 0))
+            rates = [rate for rate in self.lists[kind] if rate[kind]["id"] == target_id]
+            return 200, [
+                {key: value for key, value in rate.items() if key != kind}
+                for rate in rates
+            ]
+        return 404, {"error": "not_found"}
+
+
+class FakeMyAnimeListServer(FakeServer):
+    prefix = "/v2"
+
+    def __init__(self, lists: dict = None, fail_first: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.lists = {"anime": {}, "manga": {}}
+        for kind, entries in (lists or {}).items():
+            for entry in entries:
+                self.lists[kind][entry["node"]["id"]] = entry
+        self.fail_first = fail_first
+        self.__failures__ = {}
+        self.__refreshes__ = 0
+
+    def should_fail(self, key: tuple) -> bool:
+        with self.lock:
+            count = self.__failures__.get(key, 0)
+            self.__failures__[key] = count + 1
+            return count < self.fail_first
+
+    def _list_(self, kind: str, query: dict) -> tuple:
+        with self.lock:
+            entries = list(self.lists[kind].values())
+        if "status" in query:
+            entries = [
+                entry
+                for entry in entries
+                if entry["list_status"]["status"] == query["status"]
+            ]
+        if query.get("sort") == "list_updated_at":
+            entries.sort(key=lambda entry: entry["list_status"]["updated_at"], reverse=True)
+        limit = int(query.get("limit", 100))
+        offset = int(query.get("offset", 0))
+        result = {"data": entries[offset : offset + limit], "paging": {}}
+        if offset + limit < len(entries):
+            next_query = dict(query, offset=offset + limit)
+            result["paging"]["next"] = f"{self.url}/users/@me/{kind}list?{urlencode(next_query)}"
+        return 200, result
+
+    def _write_(self, method: str, kind: str, id_: int, form: dict) -> tuple:
+        if self.should_fail((kind, id_)):
+            return 503, {"error": "unavailable"}, {"Retry-After": "0"}
+        with self.lock:
+            if method == "DELETE":
+                if self.lists[kind].pop(id_, None) is None:
+                    return 404, {"error": "not_found"}
+                return 200, []
+            entry = self.lists[kind].setdefault(
+                id_, {"node": {"id": id_, "title": f"Title {id_}"}, "list_status": {}}
+            )
+            list_status = entry["list_status"]
+            for field, value in form.items():
+                if field == "num_watched_episodes":
+                    field = "num_episodes_watched"
+                if value.isdigit():
+                    value = int(value)
+                elif value in ("true", "false"):
+                    value = value == "true"
+                list_status[field] = value
+            list_status["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+            return 200, list_status
+
+    @property
+    def token_url(self) -> str:
+        return f"http://localhost:{self.server_port}{MAL_TOKEN_PATH}"
+
+    def _token_(self, form: dict) -> tuple:
+        if form.get("grant_type") != "refresh_token" or not form.get("refresh_token"):
+            return 400, {"error": "invalid_request"}
+        with self.lock:
+            self.__refreshes__ += 1
+            count = self.__refreshes__
+        return 200, {
+            "access_token": f"refreshed-{count}",
+            "refresh_token": f"refresh-{count}",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+        }
+
+    def route(self, method: str, path: str, query: dict, form: dict) -> tuple:
+        if method == "GET" and path == "/v2/users/@me":
+            return 200, {"id": 1, "name": "fake"}
+        if method == "POST" and path == MAL_TOKEN_PATH:
+            return self._token_(form)
+        match = MAL_LIST_PATH.match(path)
+        if method == "GET" and match:
+            return self._list_(match.group(1), query)
+        match = MAL_LIST_STATUS_PATH.match(path)
+        if method in ("PATCH", "DELETE") and match:
+            return self._write_(method, match.group(1), int(match.group(2)), form)
+        return 404, {"error": "not_found"}
@@ -0,0 +1,240 @@
+from collections import deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from pathlib import Path
+from pyrate_limiter import Limiter
+from pyrate_limiter.limit_context_decorator import LimitContextDecorator
+from pyrate_limiter.sqlite_bucket import SQLiteBucket
+from requests.adapters import HTTPAdapter
+from requests_ratelimiter import LimiterMixin
+from threading import Condition, local
+from sync4s2m.lock import get_file_lock
+
+import sqlite3
+import time
+
+
+# Writers of other processes hold the database only inside the file lock, so waiting is short
+SQLITE_TIMEOUT = 30
+
+
+def get_limiter_lock(path: Path):
+    return get_file_lock(Path(path).with_suffix(".lock"))
+
+
+class SharedSQLiteBucket(SQLiteBucket):
+    def __init__(self, **kwargs):
+        kwargs.setdefault("timeout", SQLITE_TIMEOUT)
+        super().__init__(**kwargs)
+        self._lock = get_limiter_lock(self._path)
+
+    def size(self) -> int:
+        # Other processes change the bucket too, so its size can't be cached
+        return self._query_size()
+
+    def _update_size(self, _):
+        pass
+
+
+class FairGate(object):
+    """Lets threads of different accounts take limiter slots in round robin order"""
+
+    def __init__(self):
+        self.__condition__ = Condition()
+        self.__waiting__ = {}
+        self.__order__ = deque()
+        self.__busy__ = False
+
+    def _is_next_(self, ticket) -> bool:
+        return not self.__busy__ and self.__waiting__[self.__order__[0]][0] is ticket
+
+    @contextmanager
+    def turn(self, account: str):
+        ticket = object()
+        with self.__condition__:
+            queue = self.__waiting__.setdefault(account, deque())
+            if not queue:
+                self.__order__.append(account)
+            queue.append(ticket)
+            self.__condition__.wait_for(lambda: self._is_next_(ticket))
+            self.__busy__ = True
+            queue.popleft()
+            self.__order__.popleft()
+            # Account with more waiting requests goes to the end of the line
+            if queue:
+                self.__order__.append(account)
+            else:
+                del self.__waiting__[account]
+        try:
+            yield
+        finally:
+            with self.__condition__:
+                self.__busy__ = False
+                self.__condition__.notify_all()
+
+
+class FairLimitContext(LimitContextDecorator):
+    def __init__(self, limiter: "FairLimiter", *identities: str, **kwargs):
+        super().__init__(limiter, *identities, **kwargs)
+        self.gate = limiter.gate
+        self.account = limiter.account
+
+    def delayed_acquire(self):
+        with self.gate.turn(self.account):
+            super().delayed_acquire()
+
+
+class FairLimiter(Limiter):
+    def __init__(self, *rates, gate: FairGate, account: str, **kwargs):
+        super().__init__(*rates, **kwargs)
+        self.gate = gate
+        self.account = account
+
+    def ratelimit(self, *identities: str, **kwargs) -> FairLimitContext:
+        return FairLimitContext(self, *identities, **kwargs)
+
+
+class LimiterState(object):
+    def __init__(self, path: Path, name: str):
+        self.path = Path(path)
+        self.name = name
+        # Same lock as the buckets in this file, so their writes never overlap
+        self.lock = get_limiter_lock(self.path)
+        self.__connection__ = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not self.__connection__:
+            self.__connection__ = sqlite3.connect(
+                str(self.path), check_same_thread=False, timeout=SQLITE_TIMEOUT
+            )
+            self.__connection__.execute(
+                "CREATE TABLE IF NOT EXISTS adaptive_state "
+                "(name TEXT PRIMARY KEY, blocked_until REAL, slowdown REAL)"
+            )
+        return self.__connection__
+
+    def get(self) -> tuple[float, float]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT blocked_until, slowdown FROM adaptive_state WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+        return row if row else (0.0, 1.0)
+
+    def set(self, blocked_until: float, slowdown: float):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO adaptive_state VALUES (?, ?, ?)",
+                (self.name, blocked_until, slowdown),
+            )
+            self.connection.commit()
+
+    def penalize(self, delay: float, max_slowdown: float) -> float:
+        with self.lock:
+            blocked_until, slowdown = self.get()
+            slowdown = min(slowdown * 2, max_slowdown)
+            self.set(max(blocked_until, time.time() + delay), slowdown)
+        return slowdown
+
+    def recover(self, recovery: float):
+        with self.lock:
+            blocked_until, slowdown = self.get()
+            if slowdown > 1.0:
+                self.set(blocked_until, max(1.0, slowdown * recovery))
+
+
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+# Limiter adapter waits and retries these itself
+LIMIT_STATUSES = {429}
+
+
+def get_retry_after(response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__local__ = local()
+
+    @property
+    def sent_at(self) -> float:
+        return self.__local__.sent_at
+
+    def send(self, request, **kwargs):
+        self.__local__.sent_at = time.perf_counter()
+        return super().send(request, **kwargs)
+
+
+class AdaptiveLimiterAdapter(LimiterMixin, TimedHTTPAdapter):
+    def __init__(
+        self,
+        logger: Logger,
+        path: Path,
+        name: str,
+        retries: int = 3,
+        max_slowdown: float = 16.0,
+        recovery: float = 0.9,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.logger = logger
+        self.name = name
+        self.retries = retries
+        self.max_slowdown = max_slowdown
+        self.recovery = recovery
+        self.state = LimiterState(path, name)
+        self.on_wait = None
+
+    def _wait_(self):
+        blocked_until, slowdown = self.state.get()
+        # Slowdown stretches the smallest configured interval between two requests
+        rate = self.limiter._rates[0]
+        delay = max(blocked_until - time.time(), 0.0)
+        delay += (slowdown - 1.0) * rate.interval / rate.limit
+        if delay > 0:
+            time.sleep(delay)
+
+    def _fill_bucket(self, request):
+        # Parent fills the bucket outside of its lock, racing other threads on its connection
+        bucket = self.limiter.bucket_group[self._bucket_name(request)]
+        bucket.lock_acquire()
+        try:
+            super()._fill_bucket(request)
+        finally:
+            bucket.lock_release()
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            self._wait_()
+            response = super().send(request, **kwargs)
+            if self.on_wait:
+                self.on_wait(self.sent_at - started)
+            if response.status_code not in self.limit_statuses:
+                self.state.recover(self.recovery)
+                return response
+            _, slowdown = self.state.get()
+            delay = get_retry_after(response)
+            if delay is None:
+                rate = self.limiter._rates[0]
+                delay = slowdown * rate.interval
+            slowdown = self.state.penalize(delay, self.max_slowdown)
+            self.logger.warning(
+                f"Rate limit of {self.name} exceeded, waiting {delay:.1f}s with slowdown x{slowdown:g}"
+            )
+            if attempt < self.retries:
+                response.close()
+        return response
@@ -0,0 +1,65 @@
+from pathlib import Path
+from threading import Lock, RLock
+
+try:
+    import fcntl
+
+    def _lock_file_(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file_(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+except ImportError:
+    import msvcrt
+
+    def _lock_file_(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock_file_(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock(object):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.__lock__ = RLock()
+        self.__depth__ = 0
+        self.__file__ = None
+
+    def acquire(self):
+        self.__lock__.acquire()
+        self.__depth__ += 1
+        if self.__depth__ == 1:
+            self.__file__ = open(self.path, "a")
+            _lock_file_(self.__file__)
+
+    def release(self):
+        self.__depth__ -= 1
+        if self.__depth__ == 0:
+            _unlock_file_(self.__file__)
+            self.__file__.close()
+            self.__file__ = None
+        self.__lock__.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_locks_ = {}
+_locks_lock_ = Lock()
+
+
+def get_file_lock(path: Path) -> FileLock:
+    # Two locks on the same file in one process would block each other, so share them
+    key = Path(path).resolve()
+    with _locks_lock_:
+        if key not in _locks_:
+            _locks_[key] = FileLock(key)
+        return _locks_[key]
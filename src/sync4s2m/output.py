@@ -0,0 +1,84 @@
+from string import Formatter
+from typing import Callable, Iterable, TextIO
+from sync4s2m.titlelist import Title
+
+import json
+
+
+BUFFER_SIZE = 64 * 1024
+
+TEMPLATE_FIELDS = {
+    "id": Title.get_id,
+    "name": Title.get_name,
+    "watch_status": Title.get_watch_status,
+    "watch_count": Title.get_watch_count,
+    "episodes": Title.get_episodes,
+    "chapters": Title.get_chapters,
+    "volumes": Title.get_volumes,
+    "comment": Title.get_comment,
+    "score": Title.get_score,
+    "rewatches": Title.get_rewatches,
+    "title_type": Title.get_type,
+    "modify_type": Title.get_modify_type,
+    "delta": Title.get_delta,
+}
+
+
+def template_fields(template: str) -> list[str]:
+    result = []
+    for _, field, _, _ in Formatter().parse(template):
+        if field is None:
+            continue
+        name = field.split(".")[0].split("[")[0]
+        if name not in TEMPLATE_FIELDS:
+            raise KeyError(name)
+        if name not in result:
+            result.append(name)
+    return result
+
+
+def compile_template(template: str) -> Callable[[Title], str]:
+    getters = [(name, TEMPLATE_FIELDS[name]) for name in template_fields(template)]
+    return lambda title: template.format_map(
+        {name: getter(title) for name, getter in getters}
+    )
+
+
+def write_lines(lines: Iterable[str], stream: TextIO) -> int:
+    count = 0
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        count += 1
+        if size >= BUFFER_SIZE:
+            stream.write("".join(buffer))
+            buffer.clear()
+            size = 0
+    if buffer:
+        stream.write("".join(buffer))
+    stream.flush()
+    return count
+
+
+def write_template(titles: Iterable[Title], template: str, stream: TextIO) -> int:
+    formatter = compile_template(template)
+    return write_lines((formatter(title) + "\n" for title in titles), stream)
+
+
+def write_ndjson(titles: Iterable[Title], stream: TextIO) -> int:
+    return write_lines((json.dumps(title.to_dict()) + "\n" for title in titles), stream)
+
+
+def write_json(titles: Iterable[Title], stream: TextIO) -> int:
+    def lines():
+        yield "["
+        separator = ""
+        for title in titles:
+            yield separator + json.dumps(title.to_dict())
+            separator = ", "
+        yield "]\n"
+
+    # Brackets are not titles
+    return write_lines(lines(), stream) - 2
@@ -0,0 +1,259 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from sync4s2m.limiter import LIMIT_STATUSES, TRANSIENT_STATUSES, get_retry_after
+from sync4s2m.tokens import _write_json_
+from threading import Lock
+from typing import Callable, Iterator, TYPE_CHECKING
+
+import gzip
+import json
+import os
+import shutil
+import time
+import requests
+
+if TYPE_CHECKING:
+    from sync4s2m.auth import APIManager
+
+
+PREFETCH_PAGES = 4
+PAGE_RETRIES = 5
+PAGE_BACKOFF = 1.0
+# Lists change while nobody fetches them, so older pages are not mixed with new ones
+CHECKPOINT_TTL = 3600
+# Rate limit answers already went through the retries of the limiter adapter
+PAGE_RETRY_STATUSES = TRANSIENT_STATUSES - LIMIT_STATUSES
+
+
+class PageCheckpoint(object):
+    """Pages of an unfinished download kept on disk, so the next run asks only for the rest"""
+
+    def __init__(self, path: Path, source: str, ttl: float = CHECKPOINT_TTL):
+        self.path = Path(path)
+        self.source = source
+        self.ttl = ttl
+        self.started_at = None
+        self.__lock__ = Lock()
+        self.__pages__ = None
+
+    @property
+    def meta_path(self) -> Path:
+        return self.path / "checkpoint.json"
+
+    def _page_path_(self, index: int) -> Path:
+        return self.path / f"{index}.page.gz"
+
+    def _load_(self) -> dict:
+        if self.__pages__ is not None:
+            return self.__pages__
+        meta = None
+        if self.meta_path.is_file():
+            with open(self.meta_path, "r") as file:
+                meta = json.load(file)
+        if (
+            meta
+            and meta["source"] == self.source
+            and time.time() - meta["started_at"] < self.ttl
+        ):
+            self.started_at = meta["started_at"]
+            self.__pages__ = {int(index): page for index, page in meta["pages"].items()}
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.started_at = time.time()
+            self.__pages__ = {}
+        return self.__pages__
+
+    def get_count(self) -> int:
+        with self.__lock__:
+            return len(self._load_())
+
+    def read(self, index: int) -> bytes | None:
+        with self.__lock__:
+            page = self._load_().get(index)
+        if page is None:
+            return None
+        try:
+            with gzip.open(self._page_path_(index), "rb") as file:
+                content = file.read()
+        except OSError:
+            return None
+        # Broken page is fetched again instead of being parsed
+        if sha256(content).hexdigest() != page["sha256"]:
+            return None
+        return content
+
+    def write(self, index: int, content: bytes):
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._page_path_(index)
+        temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with gzip.open(temp, "wb", compresslevel=1) as file:
+            file.write(content)
+        os.replace(temp, path)
+        with self.__lock__:
+            pages = self._load_()
+            pages[index] = {
+                "sha256": sha256(content).hexdigest(),
+                "size": len(content),
+                "saved_at": time.time(),
+            }
+            _write_json_(
+                self.meta_path,
+                {
+                    "source": self.source,
+                    "started_at": self.started_at,
+                    "pages": {str(index): page for index, page in pages.items()},
+                },
+            )
+
+    def clear(self):
+        with self.__lock__:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.__pages__ = None
+
+
+def get_content(
+    api: "APIManager",
+    url: str,
+    params: dict,
+    name: str,
+    retries: int = PAGE_RETRIES,
+    backoff: float = PAGE_BACKOFF,
+) -> bytes:
+    """Body of a GET request, dropped connections and server errors are retried with backoff"""
+    for attempt in range(retries + 1):
+        delay = backoff * 2**attempt
+        try:
+            response = api.client.get(url, params=params)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            api.logger.warning(f"Request for {name} failed: {e}")
+        else:
+            if response.ok:
+                return response.content
+            if response.status_code not in PAGE_RETRY_STATUSES or attempt == retries:
+                response.raise_for_status()
+            delay = max(delay, get_retry_after(response) or 0.0)
+            api.logger.warning(f"Request for {name} failed with {response.status_code}")
+        time.sleep(delay)
+
+
+class Paginator(object):
+    """Pages of one list endpoint, the following ones are requested before they are read"""
+
+    def __init__(
+        self,
+        api: "APIManager",
+        url: str,
+        params: dict,
+        decode: Callable,
+        limit: int,
+        prefetch: int = PREFETCH_PAGES,
+        checkpoint: PageCheckpoint = None,
+        retries: int = PAGE_RETRIES,
+        backoff: float = PAGE_BACKOFF,
+    ):
+        self.api = api
+        self.url = url
+        self.params = params
+        self.decode = decode
+        self.limit = limit
+        self.prefetch = max(prefetch, 1)
+        self.checkpoint = checkpoint
+        self.retries = retries
+        self.backoff = backoff
+
+    def _page_params_(self, index: int) -> dict:
+        raise NotImplementedError()
+
+    def _read_(self, content: bytes) -> tuple[list, bool]:
+        raise NotImplementedError()
+
+    def _fetch_(self, index: int) -> bytes:
+        return get_content(
+            self.api,
+            self.url,
+            {**self.params, **self._page_params_(index)},
+            f"page {index + 1} of {self.url}",
+            self.retries,
+            self.backoff,
+        )
+
+    def _get_(self, index: int) -> tuple[list, bool]:
+        content = self.checkpoint.read(index) if self.checkpoint is not None else None
+        saved = content is not None
+        if not saved:
+            content = self._fetch_(index)
+        page, last = self._read_(content)
+        # List of one page is fetched again as fast as it is saved, so it is not
+        if self.checkpoint is not None and not saved and (index or not last):
+            self.checkpoint.write(index, content)
+        return page, last
+
+    def _iter_pages_(self) -> Iterator:
+        # Most lists fit into one page, so nothing is guessed until the first one is full
+        page, last = self._get_(0)
+        yield from page
+        if last:
+            return
+        if self.prefetch == 1:
+            index = 1
+            while not last:
+                page, last = self._get_(index)
+                yield from page
+                index += 1
+            return
+        # Workers wait in the site limiter, so pages come at its rate, not at latency.
+        # Every page guessed past the end still costs a request of the rate limit,
+        # so the window grows by one with every full page: a list of n pages asks
+        # for at most min(n - 2, prefetch - 1) pages too many
+        window: deque[Future] = deque()
+        size = 1
+        index = 1
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            try:
+                while not last:
+                    while len(window) < size:
+                        window.append(executor.submit(self._get_, index))
+                        index += 1
+                    page, last = window.popleft().result()
+                    yield from page
+                    size = min(size + 1, self.prefetch)
+            finally:
+                # Pages guessed past the last one are empty, they are dropped unread
+                for future in window:
+                    future.cancel()
+
+    def __iter__(self) -> Iterator:
+        count = self.checkpoint.get_count() if self.checkpoint is not None else 0
+        if count:
+            self.api.logger.info(f"Resuming {self.url} with {count} saved pages")
+        yield from self._iter_pages_()
+        # Only a finished download drops its pages, broken ones are resumed next time
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+
+
+class PagePaginator(Paginator):
+    """Numbered pages from 1, the last one is not full"""
+
+    def _page_params_(self, index: int) -> dict:
+        return {"limit": self.limit, "page": index + 1}
+
+    def _read_(self, content: bytes) -> tuple[list, bool]:
+        page = self.decode(content)
+        # Shikimori may add the first entry of the next page to tell there is one
+        return page[: self.limit], len(page) < self.limit
+
+
+class OffsetPaginator(Paginator):
+    """Pages by offset, the last one has no link to the next"""
+
+    def _page_params_(self, index: int) -> dict:
+        return {"limit": self.limit, "offset": index * self.limit}
+
+    def _read_(self, content: bytes) -> tuple[list, bool]:
+        page, has_next = self.decode(content)
+        return page, not has_next
@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from urllib.parse import urlparse
+
+import cProfile
+import re
+import time
+
+
+ID_IN_PATH = re.compile(r"/\d+(?=/|$)")
+
+
+def wire_size(response) -> int:
+    # httpx counts it itself, urllib3 tells how much of compressed body it has read
+    if hasattr(response, "num_bytes_downloaded"):
+        return response.num_bytes_downloaded
+    raw = getattr(response, "raw", None)
+    if raw is not None and hasattr(raw, "tell"):
+        return raw.tell()
+    # Responses served from cache have not been downloaded at all
+    return 0
+
+
+class Profiler(object):
+    def __init__(self, dump_dir: Path = None):
+        self.dump_dir = Path(dump_dir) if dump_dir else None
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.endpoints = {}
+        self.limiter_wait = {}
+        self.__lock__ = Lock()
+        self.__profiling__ = False
+
+    def add(self, name: str, wall: float, cpu: float, titles: int = 0):
+        with self.__lock__:
+            stage = self.stages.setdefault(
+                name, {"wall": 0.0, "cpu": 0.0, "calls": 0, "titles": 0}
+            )
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["calls"] += 1
+            stage["titles"] += titles
+
+    def _start_profile_(self) -> cProfile.Profile | None:
+        # Only one cProfile may be active in a process, stages nested in it or running
+        # next to it are timed, but not dumped
+        with self.__lock__:
+            if not self.dump_dir or self.__profiling__:
+                return None
+            self.__profiling__ = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _stop_profile_(self, profile: cProfile.Profile, name: str):
+        profile.disable()
+        self.dump_dir.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(self.dump_dir / f"{name}.prof")
+        with self.__lock__:
+            self.__profiling__ = False
+
+    @contextmanager
+    def stage(self, name: str, titles=None):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        profile = self._start_profile_()
+        try:
+            yield
+        finally:
+            if profile:
+                self._stop_profile_(profile, name)
+            count = titles() if callable(titles) else titles or 0
+            self.add(
+                name,
+                time.perf_counter() - wall,
+                time.process_time() - cpu,
+                count,
+            )
+
+    def on_response(self, response, *args, **kwargs):
+        url = urlparse(str(response.request.url))
+        key = f"{response.request.method} {url.netloc}{ID_IN_PATH.sub('/{id}', url.path)}"
+        with self.__lock__:
+            endpoint = self.endpoints.setdefault(
+                key,
+                {"requests": 0, "bytes": 0, "wire_bytes": 0, "time": 0.0, "cached": 0},
+            )
+            endpoint["requests"] += 1
+            endpoint["bytes"] += len(response.content)
+            endpoint["wire_bytes"] += wire_size(response)
+            endpoint["time"] += response.elapsed.total_seconds()
+            endpoint["cached"] += int(getattr(response, "from_cache", False))
+
+    def on_limiter_wait(self, name: str, seconds: float):
+        with self.__lock__:
+            self.limiter_wait[name] = self.limiter_wait.get(name, 0.0) + seconds
+
+    def attach(self, name: str, session, adapter):
+        session.hooks["response"].append(self.on_response)
+        adapter.on_wait = lambda seconds: self.on_limiter_wait(name, seconds)
+
+    def report(self) -> dict:
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage)
+            if stage["titles"] and stage["wall"]:
+                stages[name]["titles_per_second"] = stage["titles"] / stage["wall"]
+        size = sum(e["bytes"] for e in self.endpoints.values())
+        wire = sum(e["wire_bytes"] for e in self.endpoints.values())
+        return {
+            "wall": time.perf_counter() - self.started,
+            "stages": stages,
+            "requests": {
+                "count": sum(e["requests"] for e in self.endpoints.values()),
+                "bytes": size,
+                "wire_bytes": wire,
+                "bytes_saved": size - wire,
+                "endpoints": self.endpoints,
+            },
+            "limiter_wait": {
+                "total": sum(self.limiter_wait.values()),
+                "sites": self.limiter_wait,
+            },
+        }
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from sync4s2m.titlelist import TitleList
+from typing import TYPE_CHECKING
+
+import time
+
+if TYPE_CHECKING:
+    from sync4s2m.config import Config
+    from sync4s2m.store import TitleStore
+
+
+# Changes made while the previous fetch was running must not be lost
+SNAPSHOT_OVERLAP = timedelta(minutes=5)
+# Changes of MyAnimeList do not report removed titles and Shikimori history misses
+# edits like comments, so a full fetch must catch them
+SNAPSHOT_MAX_AGE = 24 * 3600
+
+
+def parse_timestamp(value: str) -> datetime:
+    result = datetime.fromisoformat(value)
+    if not result.tzinfo:
+        result = result.replace(tzinfo=timezone.utc)
+    return result
+
+
+class Snapshot(object):
+    def __init__(
+        self, logger: Logger, config: "Config", store: "TitleStore", name: str
+    ):
+        self.logger = logger
+        self.config = config
+        self.store = store
+        self.name = name
+        self.fetched_at = None
+        self.full_at = None
+        self.titles = None
+
+    @property
+    def max_age(self) -> float:
+        result = self.config.get(f"{self.name}.snapshot_max_age", False)
+        return SNAPSHOT_MAX_AGE if result is None else result
+
+    @property
+    def since(self) -> datetime:
+        return self.fetched_at - SNAPSHOT_OVERLAP
+
+    def load(self) -> bool:
+        fetched_at = self.store.get_fetched_at(self.name)
+        if fetched_at is None:
+            self.logger.info(f"No snapshot for {self.name} found")
+            return False
+        self.fetched_at = fetched_at
+        self.full_at = self.store.get_fetched_at(self.name, True)
+        self.titles = self.store.load(self.name)
+        self.logger.info(
+            f"Loaded snapshot of {self.name} with {len(self.titles)} titles from {fetched_at.isoformat()}"
+        )
+        return True
+
+    def is_stale(self) -> bool:
+        return bool(self.max_age) and time.time() - self.full_at.timestamp() > self.max_age
+
+    def save(self, titles: TitleList, fetched_at: datetime, full: bool = True):
+        self.titles = titles
+        self.fetched_at = fetched_at
+        if full:
+            self.full_at = fetched_at
+        self.store.save(self.name, titles, fetched_at, full)
+        self.logger.info(f"Snapshot of {self.name} with {len(titles)} titles saved")
+
+    def remove(self, keys: list[tuple[str, int]]):
+        if not keys:
+            return
+        if self.titles is not None:
+            for key in keys:
+                self.titles.remove(key)
+        self.store.remove(self.name, keys)
+        self.logger.info(f"Removed {len(keys)} titles from snapshot of {self.name}")
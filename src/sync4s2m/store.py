@@ -0,0 +1,169 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+from sync4s2m.titlelist import Title, TitleList
+from typing import Iterator
+
+import sqlite3
+import time
+
+
+COLUMNS = [
+    "type",
+    "id",
+    "name",
+    "watch_status",
+    "episodes",
+    "chapters",
+    "volumes",
+    "comment",
+    "score",
+    "rewatches",
+    "updated_at",
+]
+SORT_COLUMNS = ["id", "name", "score", "updated_at", "episodes", "chapters", "volumes"]
+
+
+def parse_row(self: Title, row: tuple):
+    (
+        _,
+        self._id_,
+        self._name_,
+        self._watch_status_,
+        self._episodes_,
+        self._chapters_,
+        self._volumes_,
+        self._comment_,
+        self._score_,
+        self._rewatches_,
+        self._updated_at_,
+    ) = row
+
+
+class TitleStore(object):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.__lock__ = Lock()
+        self.__connection__ = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not self.__connection__:
+            self.__connection__ = sqlite3.connect(
+                str(self.path), check_same_thread=False, timeout=30
+            )
+            self.__connection__.executescript(
+                "CREATE TABLE IF NOT EXISTS titles (site TEXT, type TEXT, id INTEGER, "
+                "name TEXT, watch_status TEXT, episodes INTEGER, chapters INTEGER, "
+                "volumes INTEGER, comment TEXT, score INTEGER, rewatches INTEGER, "
+                "updated_at TEXT, PRIMARY KEY (site, type, id));"
+                "CREATE INDEX IF NOT EXISTS titles_status ON titles (site, watch_status);"
+                "CREATE INDEX IF NOT EXISTS titles_score ON titles (site, score);"
+                "CREATE INDEX IF NOT EXISTS titles_updated_at ON titles (site, updated_at);"
+                "CREATE TABLE IF NOT EXISTS fetches (site TEXT PRIMARY KEY, fetched_at REAL, "
+                "full_at REAL);"
+            )
+        return self.__connection__
+
+    def save(
+        self, site: str, titles: TitleList, fetched_at: datetime, full: bool = True
+    ):
+        rows = (
+            (
+                site,
+                title.get_type(),
+                title.get_id(),
+                title.get_name(),
+                title.get_watch_status(),
+                title.get_episodes(),
+                title.get_chapters(),
+                title.get_volumes(),
+                title.get_comment(),
+                title.get_score(),
+                title.get_rewatches(),
+                title.get_updated_at(),
+            )
+            for title in titles
+        )
+        # Readers see either the old list or the new one, never a half of it
+        with self.__lock__, self.connection:
+            self.connection.execute("DELETE FROM titles WHERE site = ?", (site,))
+            self.connection.executemany(
+                f"INSERT INTO titles VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                rows,
+            )
+            # List patched with changes keeps the time of the full fetch it started from
+            update = "fetched_at = excluded.fetched_at"
+            if full:
+                update += ", full_at = excluded.full_at"
+            self.connection.execute(
+                f"INSERT INTO fetches VALUES (?, ?, ?) ON CONFLICT (site) DO UPDATE SET {update}",
+                (site, fetched_at.timestamp(), fetched_at.timestamp()),
+            )
+
+    def remove(self, site: str, keys: list[tuple[str, int]]):
+        with self.__lock__, self.connection:
+            self.connection.executemany(
+                "DELETE FROM titles WHERE site = ? AND type = ? AND id = ?",
+                ((site, kind, id_) for kind, id_ in keys),
+            )
+
+    def get_fetched_at(self, site: str, full: bool = False) -> datetime | None:
+        column = "full_at" if full else "fetched_at"
+        with self.__lock__:
+            row = self.connection.execute(
+                f"SELECT {column} FROM fetches WHERE site = ?", (site,)
+            ).fetchone()
+        return datetime.fromtimestamp(row[0], timezone.utc) if row else None
+
+    def get_age(self, site: str) -> float | None:
+        fetched_at = self.get_fetched_at(site)
+        return time.time() - fetched_at.timestamp() if fetched_at else None
+
+    def query(
+        self,
+        site: str,
+        types: list[str] = None,
+        statuses: list[str] = None,
+        min_score: int = None,
+        name: str = None,
+        sort: str = None,
+        descending: bool = False,
+        limit: int = None,
+    ) -> Iterator[Title]:
+        where = ["site = ?"]
+        params = [site]
+        if types:
+            where.append(f"type IN ({', '.join('?' * len(types))})")
+            params.extend(types)
+        if statuses:
+            where.append(f"watch_status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if min_score is not None:
+            where.append("score >= ?")
+            params.append(min_score)
+        if name:
+            where.append("name LIKE ?")
+            params.append(f"%{name}%")
+        sql = f"SELECT {', '.join(COLUMNS)} FROM titles WHERE {' AND '.join(where)}"
+        if sort:
+            if sort not in SORT_COLUMNS:
+                raise ValueError(f"Can't sort by {sort}")
+            sql += f" ORDER BY {sort} {'DESC' if descending else 'ASC'}, type, id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.__lock__:
+            rows = self.connection.execute(sql, params).fetchall()
+        # Stored titles were validated before they were saved
+        for row in rows:
+            yield Title(
+                row[0],
+                raw_title=row,
+                parse_func=parse_row,
+                keep_raw=False,
+                validate=False,
+            )
+
+    def load(self, site: str) -> TitleList:
+        return TitleList(self.query(site))
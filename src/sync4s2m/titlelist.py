@@ -1,10 +1,29 @@
+from operator import attrgetter
+from typing import Iterable, Iterator
+
 import json
+import sys
 
 
 TYPE_ANIME = "anime"
 TYPE_MANGA = "manga"
 TYPE_RANOBE = "ranobe"
 TYPE = [TYPE_ANIME, TYPE_MANGA, TYPE_RANOBE]
+# MyAnimeList has no ranobe, Shikimori ranobe is a manga there with the same id
+DELTA_GROUPS = [(TYPE_ANIME,), (TYPE_MANGA, TYPE_RANOBE)]
+
+# Delta compares these on every title, so the tuple is built in C instead of by getters
+_compared_fields_ = attrgetter(
+    "_id_",
+    "_name_",
+    "_watch_status_",
+    "_episodes_",
+    "_chapters_",
+    "_volumes_",
+    "_comment_",
+    "_score_",
+    "_rewatches_",
+)
 
 MODIFY_ADDED = "added"
 MODIFY_EDITED = "edited"
@@ -29,6 +48,24 @@ WATCH = [
 
 
 class Title:
+    __slots__ = (
+        "_type_",
+        "_modify_type_",
+        "_delta_",
+        "_id_",
+        "_raw_",
+        "_name_",
+        "_watch_status_",
+        "_episodes_",
+        "_chapters_",
+        "_volumes_",
+        "_rewatches_",
+        "_comment_",
+        "_score_",
+        "_updated_at_",
+        "_fingerprint_",
+    )
+
     def __init__(
         self,
         type_: str,
@@ -36,11 +73,13 @@ class Title:
         raw_title: dict = None,
         parse_func=None,
         modify_type: str = MODIFY_UNMODIFIED,
-        delta: dict = {},
+        delta: dict = None,
+        keep_raw: bool = True,
+        validate: bool = True,
     ):
         self._type_ = type_
         self._modify_type_ = modify_type
-        self._delta_ = json.dumps(delta)
+        self._delta_ = delta
         if title:
             self._id_ = title.get_id()
             self._raw_ = title.get_raw()
@@ -52,10 +91,20 @@ class Title:
             self._rewatches_ = title.get_rewatches()
             self._comment_ = title.get_comment()
             self._score_ = title.get_score()
+            self._updated_at_ = title.get_updated_at()
         else:
             self._raw_ = raw_title
             parse_func(self, raw_title)
-        self.validate()
+        # Typed decoders check every field while decoding, there is no need to do it twice
+        if validate:
+            self.validate()
+        self._fingerprint_ = hash(self.get_compared_fields())
+        # Statuses are repeated in every title, so share one string object for each of them
+        self._type_ = sys.intern(self._type_)
+        self._modify_type_ = sys.intern(self._modify_type_)
+        self._watch_status_ = sys.intern(self._watch_status_)
+        if not keep_raw:
+            self._raw_ = None
 
     def validate(self):
         flag = False
@@ -162,8 +211,29 @@ class Title:
     def get_rewatches(self) -> int:
         return self._rewatches_
 
-    def get_delta(self) -> dict:
-        return self._delta_
+    def get_delta(self) -> str:
+        return json.dumps(self.get_delta_dict())
+
+    def get_delta_dict(self) -> dict:
+        # Most titles have no delta, an empty dict in each of them would cost 64 bytes
+        return {} if self._delta_ is None else self._delta_
+
+    def get_updated_at(self) -> str:
+        return self._updated_at_
+
+    def get_compared_fields(self) -> tuple:
+        return _compared_fields_(self)
+
+    def get_fingerprint(self) -> int:
+        return self._fingerprint_
+
+    def get_key(self) -> tuple[str, int]:
+        return (self._type_, self._id_)
+
+    def get_delta_key(self) -> str:
+        # Delta changes with the other list too, while the fingerprint is of this title only
+        delta = json.dumps(self.get_delta_dict(), sort_keys=True)
+        return f"{self._modify_type_}:{self._type_}:{self._id_}:{self._fingerprint_}:{delta}"
 
     def to_dict(self, for_comparing=False) -> dict:
         result = {}
@@ -183,11 +253,23 @@ class Title:
             result["delta"] = self.get_delta()
         return result
 
+    def to_snapshot(self) -> dict:
+        result = self.to_dict(True)
+        result["title_type"] = self.get_type()
+        result["updated_at"] = self.get_updated_at()
+        return result
+
     def format(self, template: str) -> str:
         return template.format(**self.to_dict())
 
     def delta_dict(self, other) -> dict:
-        return dict(self.to_dict().items() ^ other.to_dict().items())
+        mine = self.to_dict(True)
+        theirs = other.to_dict(True)
+        return {
+            key: [value, theirs[key]]
+            for key, value in mine.items()
+            if value != theirs[key]
+        }
 
     def __eq__(self, other) -> bool:
         return self.to_dict() == other
@@ -199,88 +281,206 @@ class Title:
 
 
 class TitleList(object):
-    def __init__(self, titles: list[Title] = []):
-        self.__title_dict__ = {title.get_id(): title for title in titles}
+    def __init__(self, titles: Iterable[Title] = ()):
+        # Anime and manga ids overlap, so every type has its own partition
+        self.__partitions__ = {type_: {} for type_ in TYPE}
+        self.extend(titles)
+
+    @classmethod
+    def _view_(cls, partitions: dict):
+        result = cls()
+        result.__partitions__ = partitions
+        return result
+
+    def partition(self, type_: str):
+        # View shares its partition, so changes made through it are seen here too
+        return TitleList._view_(
+            {t: self.__partitions__[t] if t == type_ else {} for t in TYPE}
+        )
+
+    def anime(self):
+        return self.partition(TYPE_ANIME)
+
+    def manga(self):
+        return self.partition(TYPE_MANGA)
+
+    def ranobe(self):
+        return self.partition(TYPE_RANOBE)
 
     def print_list(self, template: str):
-        for _, title in self.__title_dict__.items():
-            print(title.format(template))
+        from sync4s2m.output import write_template
+
+        write_template(self, template, sys.stdout)
 
     def __len__(self):
-        return len(self.__title_dict__)
+        return sum(len(partition) for partition in self.__partitions__.values())
 
-    def __getitem__(self, key) -> Title:
-        return self.__title_dict__[key]
+    def __getitem__(self, key: tuple[str, int]) -> Title:
+        return self.__partitions__[key[0]][key[1]]
 
-    def __delitem__(self, key):
-        del self.__title_dict__[key]
+    def __delitem__(self, key: tuple[str, int]):
+        del self.__partitions__[key[0]][key[1]]
 
     def __contains__(self, item) -> bool:
+        if isinstance(item, Title):
+            item = item.get_key()
         return (
-            isinstance(item, Title)
-            and item.get_id() in self.__title_dict__
+            isinstance(item, tuple)
+            and item[0] in self.__partitions__
+            and item[1] in self.__partitions__[item[0]]
         )
 
     def __add__(self, other):
+        result = TitleList(self)
         if isinstance(other, TitleList):
-            self.update(other)
+            result.update(other)
         elif isinstance(other, Title):
-            self.append(other)
+            result.append(other)
         else:
             raise NotImplementedError(f"Can't add {type(other)} to TitleList")
+        return result
 
     def __iter__(self):
-        return iter(self.items())
+        for partition in self.__partitions__.values():
+            yield from partition.values()
 
     def update(self, other):
-        self.__title_dict__.update(dict(other))
+        self.extend(other)
 
     def append(self, title: Title):
-        self.__title_dict__[title["id"]] = title
+        self.__partitions__[title.get_type()][title.get_id()] = title
+
+    def remove(self, key: tuple[str, int]):
+        self.__partitions__[key[0]].pop(key[1], None)
+
+    def extend(self, titles: Iterable[Title]):
+        for title in titles:
+            self.append(title)
 
     def items(self) -> list[Title]:
-        return [e[1] for e in self.__title_dict__.items()]
-
-    def delta(self, another):
-        added = [
-            Title(
-                title.get_type(), title, modify_type=MODIFY_ADDED, delta=title.to_dict(True)
-            )
-            for title in filter(lambda title: title not in another, self)
-        ]
-        removed = [
-            Title(
-                title.get_type(),
-                title,
-                modify_type=MODIFY_REMOVED,
-                delta=title.to_dict(True),
-            )
-            for title in filter(lambda title: title not in self, another)
-        ]
-        edited = []
-        for another_title in list(filter(lambda title: title in self, another)):
-            title = self[another_title.get_id()]
-            another_title_dict = another_title.to_dict(True)
-            title_dict = title.to_dict(True)
-            if title_dict != another_title_dict:
-                edited.append(
-                    Title(
+        return list(self)
+
+    def get(self, key: tuple[str, int]) -> Title | None:
+        return self.__partitions__[key[0]].get(key[1])
+
+    def _find_(self, group: tuple[str], title_id: int) -> Title | None:
+        for type_ in group:
+            result = self.__partitions__[type_].get(title_id)
+            if result is not None:
+                return result
+        return None
+
+    def filter(self, title_filter: "TitleFilter"):
+        return TitleList(title for title in self if title_filter.match(title))
+
+    def _iter_group_delta_(
+        self, another, group: tuple[str], title_filter: "TitleFilter" = None
+    ) -> Iterator[Title]:
+        match = title_filter.match if title_filter else None
+        wanted = title_filter.match_modify if title_filter else lambda _: True
+        if wanted(MODIFY_ADDED) or wanted(MODIFY_EDITED):
+            for type_ in group:
+                for title in self.__partitions__[type_].values():
+                    if match and not match(title):
+                        continue
+                    another_title = another._find_(group, title.get_id())
+                    if another_title is None:
+                        if wanted(MODIFY_ADDED):
+                            yield Title(
+                                title.get_type(),
+                                title,
+                                modify_type=MODIFY_ADDED,
+                                delta=title.to_dict(True),
+                            )
+                    elif wanted(MODIFY_EDITED) and (
+                        title.get_fingerprint() != another_title.get_fingerprint()
+                        # Equal hashes may still collide, only equal fields are no edit
+                        or _compared_fields_(title) != _compared_fields_(another_title)
+                    ):
+                        yield Title(
+                            title.get_type(),
+                            title,
+                            modify_type=MODIFY_EDITED,
+                            delta=title.delta_dict(another_title),
+                        )
+        if not wanted(MODIFY_REMOVED):
+            return
+        for type_ in group:
+            for title in another.__partitions__[type_].values():
+                if match and not match(title):
+                    continue
+                if self._find_(group, title.get_id()) is None:
+                    yield Title(
                         title.get_type(),
                         title,
-                        modify_type=MODIFY_EDITED,
-                        delta=title.delta_dict(another_title),
+                        modify_type=MODIFY_REMOVED,
+                        delta=title.to_dict(True),
                     )
-                )
-        return TitleList(added + edited + removed)
 
-    def commit(self, client, commit_func):
-        if not commit_func:
-            raise ValueError("Commit function cannot be None")
-        else:
-            commit_func(client)
-    
+    def iter_delta(self, another, title_filter: "TitleFilter" = None) -> Iterator[Title]:
+        groups = title_filter.get_groups() if title_filter else DELTA_GROUPS
+        for group in groups:
+            yield from self._iter_group_delta_(another, group, title_filter)
+
+    def delta(self, another, title_filter: "TitleFilter" = None):
+        # Comparing is pure Python work, threads would only take turns on the GIL
+        return TitleList(self.iter_delta(another, title_filter))
+
+    def commit(self, engine) -> tuple[int, int]:
+        if not engine:
+            raise ValueError("Commit engine cannot be None")
+        return engine.commit(self)
+
     def to_list(self) -> list[dict]:
-        return [title.to_dict() for title in self.items()]
+        return [title.to_dict() for title in self]
+
+
+class TitleFilter(object):
+    def __init__(
+        self,
+        types: Iterable[str] = None,
+        statuses: Iterable[str] = None,
+        modify: Iterable[str] = None,
+        ids: Iterable[int] = None,
+    ):
+        self.types = set(types) if types else None
+        self.statuses = set(statuses) if statuses else None
+        self.modify = set(modify) if modify else None
+        self.ids = set(ids) if ids else None
+
+    def __bool__(self) -> bool:
+        return any(
+            value is not None
+            for value in (self.types, self.statuses, self.modify, self.ids)
+        )
+
+    def get_kinds(self) -> list[str]:
+        # Ranobe comes from the manga lists of sites
+        return [
+            kind
+            for kind in (TYPE_ANIME, TYPE_MANGA)
+            if not self.types
+            or kind in self.types
+            or kind == TYPE_MANGA
+            and TYPE_RANOBE in self.types
+        ]
+
+    def get_groups(self) -> list[tuple[str]]:
+        return [
+            group
+            for group in DELTA_GROUPS
+            if not self.types or self.types.intersection(group)
+        ]
+
+    def match(self, title: Title) -> bool:
+        return (
+            (self.types is None or title.get_type() in self.types)
+            and (self.statuses is None or title.get_watch_status() in self.statuses)
+            and (self.ids is None or title.get_id() in self.ids)
+        )
+
+    def match_modify(self, modify_type: str) -> bool:
+        return self.modify is None or modify_type in self.modify
 
 
 def parse_shikimori(self: Title, raw_title: dict):
@@ -301,6 +501,17 @@ def parse_shikimori(self: Title, raw_title: dict):
     self._score_ = raw_title["score"]
     self._comment_ = raw_title["text"] if raw_title["text"] else ""
     self._rewatches_ = raw_title["rewatches"]
+    self._updated_at_ = raw_title.get("updated_at") or ""
+
+
+def myanimelist_status(status: str, rewatching: bool) -> str:
+    if rewatching:
+        return WATCH_REWATCHING
+    if status == "plan_to_read" or status == "plan_to_watch":
+        return WATCH_PLANNED
+    if status == "reading":
+        return WATCH_WATCHING
+    return status
 
 
 def parse_myanimelist(self: Title, raw_title: dict):
@@ -308,19 +519,10 @@ def parse_myanimelist(self: Title, raw_title: dict):
     list_status = raw_title["list_status"]
     self._id_ = node["id"]
     self._name_ = node["title"]
-    status = list_status["status"]
-    if status == "plan_to_read" or status == "plan_to_watch":
-        status = "planned"
-    if status == "reading":
-        status = "watching"
-    if (
-        "is_rewatching" in list_status
-        and list_status["is_rewatching"]
-        or "is_rereading" in list_status
-        and list_status["is_rereading"]
-    ):
-        status = "rewatching"
-    self._watch_status_ = status
+    self._watch_status_ = myanimelist_status(
+        list_status["status"],
+        list_status.get("is_rewatching") or list_status.get("is_rereading"),
+    )
     self._episodes_ = list_status.get("num_episodes_watched", 0)
     self._chapters_ = list_status.get("num_chapters_read", 0)
     self._volumes_ = list_status.get("num_volumes_read", 0)
@@ -329,3 +531,17 @@ def parse_myanimelist(self: Title, raw_title: dict):
     self._rewatches_ = list_status.get(
         "num_times_rewatched", list_status.get("num_times_reread", 0)
     )
+    self._updated_at_ = list_status.get("updated_at") or ""
+
+
+def parse_snapshot(self: Title, raw_title: dict):
+    self._id_ = raw_title["id"]
+    self._name_ = raw_title["name"]
+    self._watch_status_ = raw_title["watch_status"]
+    self._episodes_ = raw_title["episodes"]
+    self._chapters_ = raw_title["chapters"]
+    self._volumes_ = raw_title["volumes"]
+    self._score_ = raw_title["score"]
+    self._comment_ = raw_title["comment"]
+    self._rewatches_ = raw_title["rewatches"]
+    self._updated_at_ = raw_title["updated_at"]
@@ -0,0 +1,89 @@
+from logging import Logger
+from sync4s2m.config import Config
+from sync4s2m.lock import get_file_lock
+from threading import Lock
+
+import json
+import os
+import time
+
+
+# Tokens are refreshed this many seconds before they expire
+TOKEN_LEEWAY = 300
+WHOAMI_TTL = 24 * 3600
+
+_tokens_ = {}
+_tokens_lock_ = Lock()
+
+
+def _write_json_(path, data):
+    # Readers in other processes must never see a half written file
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as file:
+        json.dump(data, file, indent=2)
+    os.replace(temp, path)
+
+
+class TokenStore(object):
+    def __init__(self, logger: Logger, config: Config, name: str):
+        self.logger = logger
+        self.config = config
+        self.name = name
+
+    @property
+    def path(self):
+        return self.config.get_config_dir(True) / f"{self.name}.auth.json"
+
+    @property
+    def whoami_path(self):
+        return self.config.get_config_dir(True) / f"{self.name}.whoami.json"
+
+    @property
+    def lock(self):
+        return get_file_lock(self.config.get_config_dir(True) / f"{self.name}.auth.lock")
+
+    def load(self) -> dict:
+        path = self.path
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        key = str(path)
+        # File is read again only when somebody has rewritten it
+        with _tokens_lock_:
+            cached = _tokens_.get(key)
+            if cached and cached[0] == mtime:
+                return dict(cached[1])
+        with self.lock:
+            with open(path, "r") as file:
+                token = json.load(file)
+        with _tokens_lock_:
+            _tokens_[key] = (mtime, token)
+        return dict(token)
+
+    def save(self, token: dict):
+        path = self.path
+        with self.lock:
+            _write_json_(path, dict(token))
+            mtime = path.stat().st_mtime_ns
+        with _tokens_lock_:
+            _tokens_[str(path)] = (mtime, dict(token))
+
+    def get_whoami(self) -> dict | None:
+        ttl = self.config.get(f"{self.name}.whoami_ttl", False)
+        ttl = WHOAMI_TTL if ttl is None else ttl
+        if not ttl or not self.whoami_path.is_file():
+            return None
+        with open(self.whoami_path, "r") as file:
+            data = json.load(file)
+        if time.time() - data["cached_at"] > ttl:
+            return None
+        return data["whoami"]
+
+    def save_whoami(self, whoami: dict):
+        with self.lock:
+            _write_json_(self.whoami_path, {"cached_at": time.time(), "whoami": whoami})
+
+    def clear_whoami(self):
+        with self.lock:
+            self.whoami_path.unlink(missing_ok=True)
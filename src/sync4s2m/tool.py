@@ -1,18 +1,92 @@
-from sync4s2m.config import Config
-from sync4s2m.auth import ShikimoriAPIManager, MyAnimeListAPIManager
-from sync4s2m.titlelist import Title, TitleList, parse_shikimori, parse_myanimelist
-from authlib.integrations.requests_client import OAuth2Session
+from sync4s2m.titlelist import (
+    Title,
+    TitleList,
+    TitleFilter,
+    MODIFY_REMOVED,
+    TYPE_ANIME,
+    TYPE_MANGA,
+    parse_shikimori,
+)
+from sync4s2m.snapshot import Snapshot, parse_timestamp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Iterator, TYPE_CHECKING
 
+import json
 import logging
+import random
+import time
+
+if TYPE_CHECKING:
+    from sync4s2m.config import Config
+    from sync4s2m.auth import ShikimoriAPIManager, MyAnimeListAPIManager
+    from sync4s2m.store import TitleStore
+
+
+# Every title field is parsed from list_status, node id and title come always
+MYANIMELIST_FIELDS = "list_status"
 
 
 class Sync4Shikimori2MAL(object):
-    def __init__(self, args):
-        self.logger = self._init_logger_()
-        self.config = self._init_config_(self.logger, args)
-        self.config.load()
-        self.shikimori = self._init_shikimori_(self.logger, self.config)
-        self.myanimelist = self._init_myanimelist_(self.logger, self.config)
+    def __init__(self, args, logger: logging.Logger = None):
+        self.args = args
+        self.keep_raw = getattr(args, "keep_raw", False)
+        self.__logger__ = logger
+        self.__config__ = None
+        self.__shikimori__ = None
+        self.__myanimelist__ = None
+        self.__snapshots__ = None
+        self.__store__ = None
+        self.profiler = None
+        if getattr(args, "profile", False):
+            from sync4s2m.profiler import Profiler
+
+            self.profiler = Profiler(getattr(args, "profile_dump", None))
+
+    @property
+    def logger(self) -> logging.Logger:
+        if not self.__logger__:
+            self.__logger__ = self._init_logger_()
+        return self.__logger__
+
+    @property
+    def config(self) -> "Config":
+        if not self.__config__:
+            self.__config__ = self._init_config_(self.logger, self.args)
+            self.__config__.load()
+        return self.__config__
+
+    @property
+    def shikimori(self) -> "ShikimoriAPIManager":
+        if not self.__shikimori__:
+            self.__shikimori__ = self._init_shikimori_(self.logger, self.config)
+            self.__shikimori__.profiler = self.profiler
+        return self.__shikimori__
+
+    @property
+    def myanimelist(self) -> "MyAnimeListAPIManager":
+        if not self.__myanimelist__:
+            self.__myanimelist__ = self._init_myanimelist_(self.logger, self.config)
+            self.__myanimelist__.profiler = self.profiler
+        return self.__myanimelist__
+
+    @property
+    def snapshots(self) -> dict[str, Snapshot]:
+        if not self.__snapshots__:
+            self.__snapshots__ = {
+                name: self._init_snapshot_(self.logger, self.config, self.store, name)
+                for name in ["shikimori", "myanimelist"]
+            }
+        return self.__snapshots__
+
+    @property
+    def store(self) -> "TitleStore":
+        if not self.__store__:
+            self.__store__ = self._init_store_(self.config)
+        return self.__store__
 
     def _init_logger_(self) -> logging.Logger:
         result = logging.getLogger("")
@@ -22,23 +96,46 @@ class Sync4Shikimori2MAL(object):
         result.addHandler(handler)
         return result
 
-    def _init_config_(self, logger: logging.Logger, args) -> Config:
+    def _init_config_(self, logger: logging.Logger, args) -> "Config":
+        from sync4s2m.config import Config
+
         return Config(logger, args)
 
     def _init_shikimori_(
-        self, logger: logging.Logger, config: Config
-    ) -> ShikimoriAPIManager:
+        self, logger: logging.Logger, config: "Config"
+    ) -> "ShikimoriAPIManager":
+        from sync4s2m.auth import ShikimoriAPIManager
+
         return ShikimoriAPIManager(logger, config)
 
     def _init_myanimelist_(
-        self, logger: logging.Logger, config: Config
-    ) -> MyAnimeListAPIManager:
+        self, logger: logging.Logger, config: "Config"
+    ) -> "MyAnimeListAPIManager":
+        from sync4s2m.auth import MyAnimeListAPIManager
+
         return MyAnimeListAPIManager(logger, config)
 
-    def login(self) -> tuple[OAuth2Session]:
+    def _init_snapshot_(
+        self, logger: logging.Logger, config: "Config", store: "TitleStore", name: str
+    ) -> Snapshot:
+        return Snapshot(logger, config, store, name)
+
+    def get_export(self, name: str) -> Path | None:
+        return getattr(self.args, f"{name}_file", None)
+
+    def _init_store_(self, config: "Config") -> "TitleStore":
+        from sync4s2m.store import TitleStore
+
+        return TitleStore(config.get_config_dir(True) / "titles.sqlite")
+
+    def login(self) -> tuple:
         self.logger.info("Login and creating API sessions...")
-        self.shikimori.login()
-        self.myanimelist.login()
+        with self._stage_("login"):
+            # Lists read from export files need no API at all
+            if not self.get_export("shikimori"):
+                self.shikimori.login()
+            if not self.get_export("myanimelist"):
+                self.myanimelist.login()
         self.logger.info("API sessions created and authorized")
         return (self.shikimori, self.myanimelist)
 
@@ -48,98 +145,432 @@ class Sync4Shikimori2MAL(object):
         self.myanimelist.close()
         self.logger.info("API sessions closed")
 
-    def get_shikimori_list(self) -> TitleList:
-        api = self.shikimori.client
-        animes = []
-        index = 1
-        while True:
-            page = api.get(
-                f"/users/{self.shikimori.whoami['id']}/anime_rates",
-                params={"limit": 5000, "page": index},
-            ).json()
-            animes += page
-            if len(page) <= 5000:
-                break
-            index += 1
-        mangas = []
-        ranobes = []
-        index = 1
-        while True:
-            page = api.get(
-                f"/users/{self.shikimori.whoami['id']}/manga_rates",
-                params={"limit": 5000, "page": index},
-            ).json()
-            for e in page:
-                if "/ranobe/" in e["manga"]["url"]:
-                    ranobes.append(e)
-                else:
-                    mangas.append(e)
-            if len(page) <= 5000:
-                break
-            index += 1
-        result = [
-            Title("anime", raw_title=anime, parse_func=parse_shikimori)
-            for anime in animes
-        ]
-        result += [
-            Title("manga", raw_title=manga, parse_func=parse_shikimori)
-            for manga in mangas
-        ]
-        result += [
-            Title("ranobe", raw_title=ranobe, parse_func=parse_shikimori)
-            for ranobe in ranobes
-        ]
-        return TitleList(result)
-
-    def get_myanimelist_list(self) -> TitleList:
-        api = self.myanimelist.client
-        animes = []
-        index = 0
-        while True:
-            page = api.get(
-                f"/users/@me/animelist",
-                params={
-                    "limit": 1000,
-                    "offset": index,
-                    "fields": "list_status,media_type,status,alternative_titles",
-                },
-            ).json()
-            animes += page["data"]
-            if not "next" in page["paging"]:
-                break
-            index += 1000
-        mangas = []
-        index = 0
-        while True:
-            page = api.get(
-                f"/users/@me/mangalist",
-                params={
-                    "limit": 1000,
-                    "offset": index,
-                    "fields": "list_status,media_type,status,alternative_titles",
-                },
-            ).json()
-            mangas += page["data"]
-            if not "next" in page["paging"]:
+    def _stage_(self, name: str, titles=None):
+        if not self.profiler:
+            return nullcontext()
+        return self.profiler.stage(name, titles)
+
+    def _decode_page_(self, decode, content: bytes, kind: str):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        result = decode(content, kind, self.keep_raw)
+        if self.profiler:
+            titles = result[0] if isinstance(result, tuple) else result
+            self.profiler.add(
+                "parse",
+                time.perf_counter() - wall,
+                time.thread_time() - cpu,
+                len(titles),
+            )
+        return result
+
+    def _server_statuses_(self, site: str, kind: str, statuses) -> list[str | None]:
+        from sync4s2m.commit import MAL_ANIME_STATUS, MAL_MANGA_STATUS
+
+        if not statuses:
+            return [None]
+        if site == "shikimori":
+            return sorted(statuses)
+        # Rewatching is a flag of watching on MyAnimeList, it is filtered out after fetch
+        names = MAL_ANIME_STATUS if kind == TYPE_ANIME else MAL_MANGA_STATUS
+        return sorted({names.get(status, status) for status in statuses})
+
+    def _iter_shikimori_rates_(self, kind: str, statuses=None) -> Iterator[Title]:
+        from sync4s2m.decode import decode_shikimori_page
+
+        decode = partial(self._decode_page_, decode_shikimori_page, kind=kind)
+        for status in self._server_statuses_("shikimori", kind, statuses):
+            yield from self.shikimori.paginate(
+                f"/users/{self.shikimori.whoami['id']}/{kind}_rates",
+                {"status": status} if status else {},
+                decode,
+                5000,
+            )
+
+    def _iter_myanimelist_rates_(self, kind: str, statuses=None) -> Iterator[Title]:
+        from sync4s2m.decode import decode_myanimelist_page
+
+        decode = partial(self._decode_page_, decode_myanimelist_page, kind=kind)
+        for status in self._server_statuses_("myanimelist", kind, statuses):
+            params = {"fields": MYANIMELIST_FIELDS}
+            if status:
+                params["status"] = status
+            yield from self.myanimelist.paginate(
+                f"/users/@me/{kind}list", params, decode, 1000
+            )
+
+    def _iter_shikimori_changes_(
+        self, since: datetime
+    ) -> Iterator[tuple[tuple[str, int], Title | None]]:
+        from sync4s2m.paginator import PagePaginator, get_content
+
+        # user_rates can't be sorted or filtered by updated_at, so changed titles are
+        # found in the history, newest first. Edits that leave no history entry, like
+        # a changed comment, wait for the periodic full fetch of snapshot_max_age.
+        user_id = self.shikimori.whoami["id"]
+        history = PagePaginator(
+            self.shikimori, f"/users/{user_id}/history", {}, json.loads, 100, prefetch=1
+        )
+        targets = {}
+        for entry in history:
+            if parse_timestamp(entry["created_at"]) < since:
                 break
-            index += 1000
-        result = [
-            Title("anime", raw_title=anime, parse_func=parse_myanimelist)
-            for anime in animes
+            target = entry.get("target")
+            if not target:
+                continue
+            if target["url"].startswith("/animes/"):
+                kind = "anime"
+            elif "/ranobe/" in target["url"]:
+                kind = "ranobe"
+            else:
+                kind = "manga"
+            if (kind, target["id"]) not in targets:
+                targets[(kind, target["id"])] = target
+        self.logger.info(f"Found {len(targets)} changed titles on shikimori")
+        for key, target in targets.items():
+            kind, id_ = key
+            rates = json.loads(
+                get_content(
+                    self.shikimori,
+                    "/v2/user_rates",
+                    {
+                        "user_id": user_id,
+                        "target_id": id_,
+                        "target_type": "Anime" if kind == "anime" else "Manga",
+                    },
+                    f"rate of {kind} {id_}",
+                )
+            )
+            # Only a successful answer without a rate means the title was removed
+            if not rates:
+                yield key, None
+                continue
+            raw = rates[0]
+            raw["manga" if kind == "ranobe" else kind] = target
+            yield key, Title(
+                kind, raw_title=raw, parse_func=parse_shikimori, keep_raw=self.keep_raw
+            )
+
+    def _iter_myanimelist_changes_(
+        self, since: datetime
+    ) -> Iterator[tuple[tuple[str, int], Title | None]]:
+        from sync4s2m.decode import decode_myanimelist_page
+        from sync4s2m.paginator import OffsetPaginator
+
+        for kind in ["anime", "manga"]:
+            changes = OffsetPaginator(
+                self.myanimelist,
+                f"/users/@me/{kind}list",
+                {"sort": "list_updated_at", "fields": MYANIMELIST_FIELDS},
+                partial(self._decode_page_, decode_myanimelist_page, kind=kind),
+                100,
+                prefetch=1,
+            )
+            for title in changes:
+                if parse_timestamp(title.get_updated_at()) < since:
+                    break
+                yield title.get_key(), title
+
+    def _fetch_(self, jobs: list[tuple], parallel: bool = False) -> list[TitleList]:
+        if not parallel:
+            return [TitleList(fetch(kind)) for _, fetch, kind in jobs]
+        # Sessions are created lazily, so create them here instead of racing in workers.
+        # Every site keeps its own session and limiter, so each one stays in its own budget.
+        for api, _, _ in jobs:
+            api.client
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [
+                executor.submit(lambda job: TitleList(job[1](job[2])), job)
+                for job in jobs
+            ]
+            return [future.result() for future in futures]
+
+    def _fetch_incremental_(self, name: str, changes) -> TitleList | None:
+        snapshot = self.snapshots[name]
+        # Long running commands keep the last fetched list in memory
+        if snapshot.titles is None and not snapshot.load():
+            return None
+        if snapshot.is_stale():
+            self.logger.info(
+                f"Snapshot of {name} is older than {snapshot.max_age}s, fetching the full list"
+            )
+            return None
+        result = snapshot.titles
+        count = 0
+        for key, title in changes(snapshot.since):
+            if title:
+                result.append(title)
+            else:
+                result.remove(key)
+            count += 1
+        self.logger.info(f"Applied {count} changes to snapshot of {name}")
+        return result
+
+    def _shikimori_jobs_(self, title_filter: TitleFilter = None) -> list[tuple]:
+        kinds = title_filter.get_kinds() if title_filter else [TYPE_ANIME, TYPE_MANGA]
+        statuses = title_filter.statuses if title_filter else None
+        return [
+            (
+                self.shikimori,
+                partial(self._iter_shikimori_rates_, statuses=statuses),
+                kind,
+            )
+            for kind in kinds
         ]
-        result += [
-            Title("manga", raw_title=manga, parse_func=parse_myanimelist)
-            for manga in mangas
+
+    def _myanimelist_jobs_(self, title_filter: TitleFilter = None) -> list[tuple]:
+        kinds = title_filter.get_kinds() if title_filter else [TYPE_ANIME, TYPE_MANGA]
+        statuses = title_filter.statuses if title_filter else None
+        return [
+            (
+                self.myanimelist,
+                partial(self._iter_myanimelist_rates_, statuses=statuses),
+                kind,
+            )
+            for kind in kinds
         ]
-        return TitleList(result)
 
-    def get_delta(self, source: str = "shikimori") -> TitleList:
-        shikimori = self.get_shikimori_list()
-        myanimelist = self.get_myanimelist_list()
+    @staticmethod
+    def _pushdown_(title_filter: TitleFilter, incremental: bool) -> TitleFilter | None:
+        # Incremental fetch updates the whole saved list, so it is filtered afterwards
+        if incremental or not title_filter:
+            return None
+        if title_filter.types is None and title_filter.statuses is None:
+            return None
+        return title_filter
 
-        if source == "shikimori":
-            return shikimori.delta(myanimelist)
-        elif source == "myanimelist":
-            return myanimelist.delta(shikimori)
-        else:
+    def _iter_export_(self, name: str) -> Iterator[Title]:
+        from sync4s2m.export import iter_export
+
+        path = self.get_export(name)
+        self.logger.info(f"Reading {name} list from {path}")
+        return iter_export(path, self.keep_raw)
+
+    def iter_shikimori_list(self, title_filter: TitleFilter = None) -> Iterator[Title]:
+        if self.get_export("shikimori"):
+            yield from self._iter_export_("shikimori")
+            return
+        for _, fetch, kind in self._shikimori_jobs_(title_filter):
+            yield from fetch(kind)
+
+    def iter_myanimelist_list(
+        self, title_filter: TitleFilter = None
+    ) -> Iterator[Title]:
+        if self.get_export("myanimelist"):
+            yield from self._iter_export_("myanimelist")
+            return
+        for _, fetch, kind in self._myanimelist_jobs_(title_filter):
+            yield from fetch(kind)
+
+    def get_shikimori_list(
+        self,
+        parallel: bool = False,
+        incremental: bool = False,
+        title_filter: TitleFilter = None,
+    ) -> TitleList:
+        if self.get_export("shikimori"):
+            # Export may be old, so it is never saved as a snapshot
+            result = None
+            with self._stage_("export.shikimori", lambda: len(result) if result else 0):
+                result = TitleList(self._iter_export_("shikimori"))
+            return result
+        fetched_at = datetime.now(timezone.utc)
+        result = None
+        pushdown = self._pushdown_(title_filter, incremental)
+        with self._stage_("fetch.shikimori", lambda: len(result) if result else 0):
+            if incremental:
+                result = self._fetch_incremental_(
+                    "shikimori", self._iter_shikimori_changes_
+                )
+            full = result is None
+            if result is None and not parallel:
+                result = TitleList(self.iter_shikimori_list(pushdown))
+            elif result is None:
+                result = TitleList()
+                for part in self._fetch_(self._shikimori_jobs_(pushdown), parallel):
+                    result.update(part)
+        # Filtered fetch is only a part of the list and can't replace the saved one
+        if not pushdown:
+            self.snapshots["shikimori"].save(result, fetched_at, full)
+        return result
+
+    def get_myanimelist_list(
+        self,
+        parallel: bool = False,
+        incremental: bool = False,
+        title_filter: TitleFilter = None,
+    ) -> TitleList:
+        if self.get_export("myanimelist"):
+            # Export may be old, so it is never saved as a snapshot
+            result = None
+            with self._stage_("export.myanimelist", lambda: len(result) if result else 0):
+                result = TitleList(self._iter_export_("myanimelist"))
+            return result
+        fetched_at = datetime.now(timezone.utc)
+        result = None
+        pushdown = self._pushdown_(title_filter, incremental)
+        with self._stage_("fetch.myanimelist", lambda: len(result) if result else 0):
+            if incremental:
+                result = self._fetch_incremental_(
+                    "myanimelist", self._iter_myanimelist_changes_
+                )
+            full = result is None
+            if result is None and not parallel:
+                result = TitleList(self.iter_myanimelist_list(pushdown))
+            elif result is None:
+                result = TitleList()
+                for part in self._fetch_(self._myanimelist_jobs_(pushdown), parallel):
+                    result.update(part)
+        # Filtered fetch is only a part of the list and can't replace the saved one
+        if not pushdown:
+            self.snapshots["myanimelist"].save(result, fetched_at, full)
+        return result
+
+    def get_stored_list(self, site: str, max_age: float) -> TitleList | None:
+        age = self.store.get_age(site)
+        if age is None or age > max_age:
+            return None
+        self.logger.info(f"Using stored {site} list fetched {age:.0f} seconds ago")
+        result = None
+        with self._stage_("store", lambda: len(result) if result else 0):
+            result = self.store.load(site)
+        return result
+
+    def _get_lists_(
+        self,
+        source: str,
+        parallel: bool,
+        incremental: bool,
+        title_filter: TitleFilter = None,
+    ) -> tuple[TitleList, TitleList]:
+        if source not in ("shikimori", "myanimelist"):
             raise NotImplementedError(f"Source {source} not implemented")
+        filters = {"shikimori": None, "myanimelist": None}
+        if title_filter:
+            # Statuses can be filtered on source side only when removed titles are
+            # not asked for, they are found by the whole source list
+            target_filter = TitleFilter(types=title_filter.types)
+            filters = {"shikimori": target_filter, "myanimelist": target_filter}
+            if not title_filter.match_modify(MODIFY_REMOVED):
+                filters[source] = TitleFilter(
+                    types=title_filter.types, statuses=title_filter.statuses
+                )
+        if parallel:
+            # Store, its connection and snapshots are created lazily, so create them
+            # here instead of racing in workers, like the sessions in _fetch_
+            self.store.connection
+            self.snapshots
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                shikimori = executor.submit(
+                    self.get_shikimori_list,
+                    parallel,
+                    incremental,
+                    filters["shikimori"],
+                )
+                myanimelist = executor.submit(
+                    self.get_myanimelist_list,
+                    parallel,
+                    incremental,
+                    filters["myanimelist"],
+                )
+                shikimori = shikimori.result()
+                myanimelist = myanimelist.result()
+        else:
+            shikimori = self.get_shikimori_list(
+                incremental=incremental, title_filter=filters["shikimori"]
+            )
+            myanimelist = self.get_myanimelist_list(
+                incremental=incremental, title_filter=filters["myanimelist"]
+            )
+        if source == "shikimori":
+            return shikimori, myanimelist
+        return myanimelist, shikimori
+
+    def iter_delta(
+        self,
+        source: str = "shikimori",
+        parallel: bool = False,
+        incremental: bool = False,
+        title_filter: TitleFilter = None,
+    ) -> Iterator[Title]:
+        this, another = self._get_lists_(source, parallel, incremental, title_filter)
+        yield from this.iter_delta(another, title_filter)
+
+    def get_delta(
+        self,
+        source: str = "shikimori",
+        parallel: bool = False,
+        incremental: bool = False,
+        title_filter: TitleFilter = None,
+    ) -> TitleList:
+        this, another = self._get_lists_(source, parallel, incremental, title_filter)
+        with self._stage_("delta", len(this) + len(another)):
+            return this.delta(another, title_filter)
+
+    def commit(
+        self, parallel: bool = False, incremental: bool = False, workers: int = 4
+    ) -> tuple[int, int]:
+        from sync4s2m.commit import CommitEngine
+
+        delta = self.get_delta(parallel=parallel, incremental=incremental)
+        engine = CommitEngine(self.logger, self.config, self.myanimelist, workers)
+        try:
+            with self._stage_("commit", len(delta)):
+                return delta.commit(engine)
+        finally:
+            # Changes of MyAnimeList do not report deletions, so the next
+            # incremental fetch would bring the deleted titles back
+            self.snapshots["myanimelist"].remove(engine.deleted)
+
+    def plan(
+        self, parallel: bool = False, incremental: bool = False, workers: int = 4
+    ) -> dict:
+        from sync4s2m.commit import CommitEngine
+
+        delta = self.get_delta(parallel=parallel, incremental=incremental)
+        engine = CommitEngine(self.logger, self.config, self.myanimelist, workers)
+        with self._stage_("plan", len(delta)):
+            plan = engine.plan(delta)
+        return plan.report(self.config.get_rates(self.myanimelist.name), workers)
+
+    def watch(
+        self,
+        on_delta,
+        source: str = "shikimori",
+        interval: float = 300.0,
+        jitter: float = 0.1,
+        max_backoff: float = 3600.0,
+        full_every: int = 12,
+        parallel: bool = False,
+        ticks: int | None = None,
+    ):
+        # Sessions, limiters and fetched lists live as long as this tool,
+        # so every tick after the first one only downloads recent changes
+        self.login()
+        seen = set()
+        failures = 0
+        tick = 0
+        while ticks is None or tick < ticks:
+            # MyAnimeList changes do not report removed titles, full fetch catches them
+            incremental = bool(full_every) and tick % full_every != 0
+            try:
+                delta = self.get_delta(source, parallel, incremental)
+                keys = {title.get_delta_key() for title in delta}
+                on_delta(
+                    TitleList(
+                        title for title in delta if title.get_delta_key() not in seen
+                    )
+                )
+                seen = keys
+                failures = 0
+                delay = interval
+            except Exception as e:
+                failures += 1
+                delay = min(interval * 2**failures, max_backoff)
+                self.logger.exception(f"Watch tick failed ({failures} in a row): {e}")
+            tick += 1
+            if ticks is not None and tick >= ticks:
+                break
+            delay *= 1 + random.uniform(-jitter, jitter)
+            self.logger.info(f"Next check in {delay:.0f} seconds")
+            time.sleep(delay)
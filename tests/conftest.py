@@ -0,0 +1,93 @@
+from argparse import Namespace
+from pathlib import Path
+from sync4s2m.fake import FakeShikimoriServer, FakeMyAnimeListServer, make_dataset
+from sync4s2m.tool import Sync4Shikimori2MAL
+
+import json
+import logging
+import time
+import pytest
+
+
+def write_config(path: Path, shikimori_url: str, myanimelist_url: str, rate: int = 1000):
+    limits = [
+        {"count": rate, "unit": "SECOND", "factor": 1},
+        {"count": rate * 60, "unit": "MINUTE", "factor": 1},
+    ]
+    config = {
+        "shikimori": {
+            "app_name": "test",
+            "client_id": "test",
+            "client_secret": "test",
+            "port": 1,
+            "domain": "one",
+            "api_url": shikimori_url,
+        },
+        "myanimelist": {"client_id": "test", "port": 1, "api_url": myanimelist_url},
+        "rate_limiter": {"shikimori": limits, "myanimelist": limits},
+        "cache": {"max_size_mb": 0},
+    }
+    with open(path / "config.json", "w") as file:
+        json.dump(config, file)
+    token = {
+        "access_token": "test",
+        "refresh_token": "test",
+        "token_type": "Bearer",
+        "expires_at": int(time.time()) + 24 * 3600,
+    }
+    for name in ["shikimori", "myanimelist"]:
+        with open(path / f"{name}.auth.json", "w") as file:
+            json.dump(token, file)
+
+
+@pytest.fixture
+def logger() -> logging.Logger:
+    return logging.getLogger("sync4s2m.test")
+
+
+@pytest.fixture
+def dataset() -> tuple[dict, dict]:
+    return make_dataset(300)
+
+
+@pytest.fixture
+def shikimori_server(dataset):
+    server = FakeShikimoriServer(dataset[0])
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def myanimelist_server(dataset):
+    server = FakeMyAnimeListServer(dataset[1])
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def config_dir(tmp_path, shikimori_server, myanimelist_server) -> Path:
+    write_config(tmp_path, shikimori_server.url, myanimelist_server.url)
+    return tmp_path
+
+
+@pytest.fixture
+def make_tool(config_dir, logger):
+    tools = []
+
+    def make(**kwargs) -> Sync4Shikimori2MAL:
+        tool = Sync4Shikimori2MAL(Namespace(config=config_dir, **kwargs), logger)
+        tools.append(tool)
+        return tool
+
+    yield make
+    for tool in tools:
+        tool.logout()
+
+
+@pytest.fixture
+def tool(make_tool) -> Sync4Shikimori2MAL:
+    return make_tool()
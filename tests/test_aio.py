@@ -0,0 +1,99 @@
+from sync4s2m.tokens import TokenStore
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import pytest
+
+aio = pytest.importorskip("sync4s2m.aio")
+pytest.importorskip("httpx")
+
+
+def make_manager(tool, myanimelist_server) -> "aio.AsyncMyAnimeListAPIManager":
+    result = aio.AsyncMyAnimeListAPIManager(tool.logger, tool.config)
+    result.manager.token_uri = myanimelist_server.token_url
+    return result
+
+
+def expire_token(config_dir):
+    path = config_dir / "myanimelist.auth.json"
+    with open(path, "r") as file:
+        token = json.load(file)
+    token["expires_at"] = int(time.time()) - 10
+    with open(path, "w") as file:
+        json.dump(token, file)
+
+
+def bucket_size(config_dir) -> int:
+    with sqlite3.connect(config_dir / "ratelimit.sqlite") as connection:
+        tables = [
+            row[0]
+            for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE 'ratelimit_%'"
+            )
+        ]
+        return sum(
+            connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in tables
+        )
+
+
+def test_async_requests_share_limiter_budget(tool, myanimelist_server, config_dir):
+    async def run():
+        async with make_manager(tool, myanimelist_server) as manager:
+            await manager.login()
+            return await asyncio.gather(
+                *(manager.get("/users/@me/animelist", params={"limit": 10}) for _ in range(20))
+            )
+
+    responses = asyncio.run(run())
+    assert all(response.status_code == 200 for response in responses)
+    # Whoami and the pages all went through the SQLite bucket of the sync clients
+    assert bucket_size(config_dir) == 21
+    tool.myanimelist.client.get("/users/@me")
+    assert bucket_size(config_dir) == 22
+
+
+def test_async_refresh_happens_once_and_is_saved(tool, myanimelist_server, config_dir):
+    expire_token(config_dir)
+
+    async def run():
+        async with make_manager(tool, myanimelist_server) as manager:
+            return await asyncio.gather(*(manager.get("/users/@me") for _ in range(10)))
+
+    responses = asyncio.run(run())
+    assert all(response.status_code == 200 for response in responses)
+    refreshes = [path for method, path in myanimelist_server.requests if method == "POST"]
+    assert len(refreshes) == 1
+    assert TokenStore(tool.logger, tool.config, "myanimelist").load()["access_token"] == "refreshed-1"
+
+
+def test_async_token_io_does_not_block_loop(tool, myanimelist_server):
+    store = TokenStore(tool.logger, tool.config, "myanimelist")
+    held = threading.Event()
+    release = threading.Event()
+    released = []
+
+    def hold():
+        with store.lock:
+            held.set()
+            # Blocked loop never runs unlock, so the wait times out
+            released.append(release.wait(2))
+
+    async def unlock():
+        await asyncio.sleep(0.3)
+        release.set()
+
+    async def run():
+        async with make_manager(tool, myanimelist_server) as manager:
+            # Token file was never read in this test, so loading it waits for the lock
+            await asyncio.gather(manager.login(), unlock())
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(2)
+    asyncio.run(run())
+    thread.join()
+    assert released == [True]
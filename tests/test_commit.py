@@ -0,0 +1,107 @@
+from email.utils import formatdate
+from sync4s2m.commit import CommitEngine
+
+from pathlib import Path
+
+import os
+import subprocess
+import sync4s2m
+import sys
+import time
+
+
+def make_engine(tool, **kwargs) -> CommitEngine:
+    kwargs.setdefault("retries", 1)
+    kwargs.setdefault("backoff", 0.0)
+    return CommitEngine(tool.logger, tool.config, tool.myanimelist, **kwargs)
+
+
+def written(server) -> list[tuple[str, str]]:
+    return [request for request in server.requests if request[0] != "GET"]
+
+
+def test_commit_adds_edits_and_deletes(tool, myanimelist_server):
+    tool.login()
+    delta = tool.get_delta()
+    assert delta.partition("anime") or delta.partition("manga")
+    assert {title.get_modify_type() for title in delta} == {"added", "edited", "removed"}
+    plan = tool.plan()
+    assert plan["methods"]["PATCH"] and plan["methods"]["DELETE"]
+
+    done, failed = delta.commit(make_engine(tool))
+
+    assert (done, failed) == (plan["requests"], 0)
+    assert len(written(myanimelist_server)) == plan["requests"]
+    # Names of added titles differ on the fake, but names are never written
+    assert tool.plan()["requests"] == 0
+
+
+def test_commit_resumes_from_journal(tool, myanimelist_server):
+    tool.login()
+    delta = tool.get_delta()
+    failing = {
+        ("anime" if title.is_anime() else "manga", title.get_id())
+        for title in list(delta)[:5]
+    }
+    myanimelist_server.should_fail = lambda key: key in failing
+
+    done, failed = delta.commit(make_engine(tool))
+    assert failed == len(failing)
+
+    myanimelist_server.should_fail = lambda key: False
+    before = len(written(myanimelist_server))
+    engine = make_engine(tool)
+    assert engine.plan(delta).done == done
+    assert delta.commit(engine) == (len(failing), 0)
+    assert len(written(myanimelist_server)) - before == len(failing)
+    assert not engine.journal.path.exists()
+
+
+def test_commit_waits_for_retry_after_date(tool, myanimelist_server):
+    tool.login()
+    delta = tool.get_delta()
+    limited_keys = {
+        ("anime" if title.is_anime() else "manga", title.get_id())
+        for title in list(delta)[:3]
+    }
+    calls = {}
+    write = myanimelist_server._write_
+
+    # More 429 answers than the limiter adapter retries, so the engine sees them too
+    def limited(method, kind, id_, form):
+        calls[(kind, id_)] = calls.get((kind, id_), 0) + 1
+        if (kind, id_) in limited_keys and calls[(kind, id_)] <= 5:
+            return 429, {"error": "too_many_requests"}, {
+                "Retry-After": formatdate(time.time(), usegmt=True)
+            }
+        return write(method, kind, id_, form)
+
+    myanimelist_server._write_ = limited
+    plan = tool.plan()
+    done, failed = delta.commit(make_engine(tool, retries=2))
+    assert (done, failed) == (plan["requests"], 0)
+
+
+def test_journal_key_is_stable_between_processes():
+    code = (
+        "from sync4s2m.commit import Journal\n"
+        "from sync4s2m.titlelist import Title, parse_snapshot\n"
+        "raw = dict(id=5, name='Title', watch_status='completed', episodes=3, chapters=0,"
+        " volumes=0, comment='', score=7, rewatches=0, updated_at='')\n"
+        "print(Journal.key(Title('anime', raw_title=raw, parse_func=parse_snapshot)))\n"
+    )
+    keys = {
+        subprocess.run(
+            [sys.executable, "-c", code],
+            env={
+                **os.environ,
+                "PYTHONHASHSEED": str(seed),
+                "PYTHONPATH": str(Path(sync4s2m.__file__).parents[1]),
+            },
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for seed in (1, 2)
+    }
+    assert len(keys) == 1
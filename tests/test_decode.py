@@ -0,0 +1,24 @@
+from sync4s2m.decode import decode_shikimori_page, get_backend
+
+import pytest
+
+
+def test_shikimori_rate_without_target_is_rejected():
+    pytest.importorskip("msgspec")
+    content = b'[{"status": "watching", "score": 5, "manga": {"id": 1, "name": "Title 1"}}]'
+    with pytest.raises(ValueError, match="no anime"):
+        decode_shikimori_page(content, "anime", backend="msgspec")
+
+
+def test_shikimori_rate_takes_target_of_requested_kind():
+    pytest.importorskip("msgspec")
+    content = (
+        b'[{"status": "watching", "score": 5, "anime": {"id": 1, "name": "Anime 1"},'
+        b' "manga": {"id": 2, "name": "Manga 2", "url": "/mangas/2"}}]'
+    )
+    (title,) = decode_shikimori_page(content, "manga", backend="msgspec")
+    assert title.get_key() == ("manga", 2)
+
+
+def test_shikimori_never_prefers_orjson():
+    assert get_backend("shikimori") in ("msgspec", "json")
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from pyrate_limiter import BucketFullException, Limiter, RequestRate
+from sync4s2m.limiter import AdaptiveLimiterAdapter, SharedSQLiteBucket, get_retry_after
+from urllib.parse import urlparse
+
+import pytest
+import requests
+import time
+
+
+def make_limiter(path, time_function=time.time) -> Limiter:
+    return Limiter(
+        RequestRate(200, 1),
+        bucket_class=SharedSQLiteBucket,
+        bucket_kwargs={"path": path},
+        time_function=time_function,
+    )
+
+
+def test_fill_bucket_and_state_from_many_threads(tmp_path, logger):
+    path = tmp_path / "ratelimit.sqlite"
+    # Stopped clock keeps every fill in one window
+    now = time.time()
+    limiter = make_limiter(path, lambda: now)
+    adapter = AdaptiveLimiterAdapter(logger, path, "test", limiter=limiter)
+    request = requests.Request("GET", "http://localhost/list").prepare()
+    limiter.try_acquire(adapter._bucket_name(request))
+
+    # 429 answers of parallel requests fill the bucket and slow the state down together
+    def limited(index: int):
+        for _ in range(50):
+            adapter._fill_bucket(request)
+            adapter.state.penalize(0.0, float("inf"))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(limited, range(8)))
+    # Every fill tops the same window up to the limit, lost updates would overshoot it
+    bucket = limiter.bucket_group[adapter._bucket_name(request)]
+    count, _ = bucket.inspect_expired_items(now - 1)
+    assert count == 200
+    # Lost read-modify-write of the state would skip some of the doublings
+    assert adapter.state.get()[1] == 2.0**400
+
+
+def test_limited_answer_slows_down_and_recovers(tmp_path, logger, myanimelist_server, monkeypatch):
+    path = tmp_path / "ratelimit.sqlite"
+    adapter = AdaptiveLimiterAdapter(logger, path, "test", retries=0, limiter=make_limiter(path))
+    session = requests.Session()
+    session.mount("http://", adapter)
+    url = f"{myanimelist_server.url}/users/@me"
+    monkeypatch.setattr(
+        myanimelist_server,
+        "route",
+        lambda *args: (429, {"error": "too_many_requests"}, {"Retry-After": "0.5"}),
+    )
+    before = time.time()
+    assert session.get(url).status_code == 429
+    blocked_until, slowdown = adapter.state.get()
+    assert slowdown == 2.0
+    assert blocked_until >= before + 0.5
+
+    # Another process opens the same files and sees the filled bucket and the slowdown
+    other = AdaptiveLimiterAdapter(logger, path, "test", limiter=make_limiter(path))
+    assert other.state.get() == (blocked_until, slowdown)
+    with pytest.raises(BucketFullException):
+        other.limiter.try_acquire(urlparse(url).netloc)
+
+    monkeypatch.undo()
+    assert session.get(url).status_code == 200
+    assert time.time() >= blocked_until
+    assert adapter.state.get()[1] == pytest.approx(2.0 * 0.9)
+
+
+@pytest.mark.parametrize("value", ["soon", "Mon, 99 Foo 2024 25:00:00 GMT"])
+def test_malformed_retry_after_is_ignored(value):
+    response = requests.Response()
+    response.headers["Retry-After"] = value
+    assert get_retry_after(response) is None
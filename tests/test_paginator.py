@@ -0,0 +1,75 @@
+from itertools import islice
+from math import ceil
+from sync4s2m.paginator import OffsetPaginator, PageCheckpoint
+
+import json
+import pytest
+import requests
+
+
+def decode(content: bytes) -> tuple[list, bool]:
+    page = json.loads(content)
+    return page["data"], "next" in page["paging"]
+
+
+def make_paginator(tool, checkpoint, limit: int = 10, **kwargs) -> OffsetPaginator:
+    kwargs.setdefault("prefetch", 1)
+    kwargs.setdefault("backoff", 0.0)
+    return OffsetPaginator(
+        tool.myanimelist, "/users/@me/animelist", {}, decode, limit, checkpoint=checkpoint, **kwargs
+    )
+
+
+def listed(server) -> int:
+    return sum(1 for method, path in server.requests if path.endswith("/animelist"))
+
+
+@pytest.fixture
+def checkpoint(tmp_path) -> PageCheckpoint:
+    return PageCheckpoint(tmp_path / "pages", "animelist")
+
+
+def test_paginator_resumes_from_checkpoint(tool, myanimelist_server, checkpoint):
+    entries = list(make_paginator(tool, None))
+    pages = listed(myanimelist_server)
+    assert pages > 3
+
+    # Generator dropped half way leaves its pages behind
+    assert len(list(islice(make_paginator(tool, checkpoint), 25))) == 25
+    assert checkpoint.get_count() == 3
+
+    before = listed(myanimelist_server)
+    assert list(make_paginator(tool, checkpoint)) == entries
+    assert listed(myanimelist_server) - before == pages - 3
+    assert not checkpoint.path.exists()
+
+
+def test_paginator_does_not_save_single_page(tool, checkpoint):
+    paginator = iter(make_paginator(tool, checkpoint, limit=1000))
+    next(paginator)
+    assert not checkpoint.path.exists()
+    assert list(paginator)
+
+
+@pytest.mark.parametrize("pages", [2, 3, 4, 12])
+def test_paginator_prefetch_overshoot_grows_with_list(tool, myanimelist_server, pages):
+    count = len(list(make_paginator(tool, None, limit=1000)))
+    before = listed(myanimelist_server)
+    limit = ceil(count / pages)
+    entries = list(make_paginator(tool, None, limit=limit, prefetch=4))
+    assert len(entries) == count
+    assert ceil(count / limit) == pages
+    # Guessed pages not started yet are cancelled, so this is only the bound
+    assert pages <= listed(myanimelist_server) - before <= pages + min(pages - 2, 3)
+
+
+def test_paginator_leaves_rate_limits_to_adapter(tool, myanimelist_server, checkpoint, monkeypatch):
+    monkeypatch.setattr(
+        myanimelist_server,
+        "_list_",
+        lambda kind, query: (429, {"error": "too_many_requests"}, {"Retry-After": "0"}),
+    )
+    with pytest.raises(requests.HTTPError):
+        list(make_paginator(tool, checkpoint))
+    # One request and the retries of the adapter, none of the paginator on top
+    assert listed(myanimelist_server) == 4
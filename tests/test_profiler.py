@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+from sync4s2m.profiler import Profiler
+
+import threading
+
+
+def test_nested_stage_is_timed_but_not_dumped(tmp_path):
+    profiler = Profiler(tmp_path)
+    with profiler.stage("output"):
+        with profiler.stage("fetch.shikimori", 3):
+            pass
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["output.prof"]
+    assert profiler.report()["stages"]["fetch.shikimori"]["titles"] == 3
+
+
+def test_concurrent_stages_keep_one_profile(tmp_path):
+    profiler = Profiler(tmp_path)
+    barrier = threading.Barrier(2)
+
+    def fetch(name: str):
+        with profiler.stage(name):
+            barrier.wait()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(fetch, ["fetch.shikimori", "fetch.myanimelist"]))
+    assert len(list(tmp_path.iterdir())) == 1
+    assert profiler.report()["stages"].keys() == {"fetch.shikimori", "fetch.myanimelist"}
+    with profiler.stage("delta"):
+        pass
+    assert (tmp_path / "delta.prof").is_file()
@@ -0,0 +1,95 @@
+from datetime import datetime, timezone
+
+import pytest
+import requests
+import time
+
+
+def keys(titles) -> list:
+    return sorted(title.get_key() for title in titles)
+
+
+def test_incremental_fetch_loads_snapshot_from_store(make_tool, config_dir):
+    full = make_tool().get_myanimelist_list()
+    tool = make_tool()
+    result = tool.get_myanimelist_list(incremental=True)
+    snapshot = tool.snapshots["myanimelist"]
+    assert snapshot.titles is result
+    assert snapshot.fetched_at is not None
+    assert keys(result) == keys(full)
+    assert keys(tool.store.load("myanimelist")) == keys(full)
+    assert not list(config_dir.glob("*.snapshot.json"))
+
+
+def test_commit_removes_deleted_titles_from_snapshot(make_tool, myanimelist_server):
+    tool = make_tool()
+    tool.login()
+    tool.commit()
+    assert any(method == "DELETE" for method, _ in myanimelist_server.requests)
+    result = make_tool().get_myanimelist_list(incremental=True)
+    assert keys(result) == keys(make_tool().get_myanimelist_list())
+
+
+def test_incremental_fetch_keeps_time_of_full_fetch(make_tool):
+    tool = make_tool()
+    tool.get_myanimelist_list()
+    full_at = tool.snapshots["myanimelist"].full_at
+    tool = make_tool()
+    tool.get_myanimelist_list(incremental=True)
+    snapshot = tool.snapshots["myanimelist"]
+    assert snapshot.fetched_at > full_at
+    assert tool.store.get_fetched_at("myanimelist", True) == full_at
+
+
+def test_stale_snapshot_is_fetched_in_full(make_tool):
+    tool = make_tool()
+    tool.get_myanimelist_list()
+    with tool.store.connection:
+        tool.store.connection.execute("UPDATE fetches SET full_at = full_at - 2 * 86400")
+    stale_at = tool.store.get_fetched_at("myanimelist", True)
+    tool = make_tool()
+    tool.get_myanimelist_list(incremental=True)
+    assert tool.snapshots["myanimelist"].full_at > stale_at
+    assert tool.store.get_fetched_at("myanimelist", True) > stale_at
+
+
+def test_failed_change_request_keeps_snapshot(make_tool, shikimori_server, monkeypatch):
+    tool = make_tool()
+    tool.login()
+    tool.get_shikimori_list()
+    target = shikimori_server.lists["anime"][0]["anime"]
+    route = shikimori_server.route
+
+    def failing(method, path, query, form):
+        if path.endswith("/history"):
+            created_at = datetime.now(timezone.utc).isoformat()
+            return 200, [{"created_at": created_at, "target": target}]
+        # Error without a rate in it must not read as a removed title
+        if path == "/api/v2/user_rates":
+            return 404, []
+        return route(method, path, query, form)
+
+    monkeypatch.setattr(shikimori_server, "route", failing)
+    tool = make_tool()
+    tool.login()
+    with pytest.raises(requests.HTTPError):
+        tool.get_shikimori_list(incremental=True)
+    assert ("anime", target["id"]) in keys(tool.store.load("shikimori"))
+
+
+def test_parallel_delta_shares_one_store(make_tool, monkeypatch):
+    tool = make_tool()
+    tool.login()
+    stores = []
+    init_store = tool._init_store_
+
+    def counted(config):
+        # Slow store widens the window in which workers would race to create it
+        time.sleep(0.2)
+        stores.append(init_store(config))
+        return stores[-1]
+
+    monkeypatch.setattr(tool, "_init_store_", counted)
+    tool.get_delta(parallel=True)
+    assert len(stores) == 1
+    assert tool.snapshots["shikimori"].store is tool.snapshots["myanimelist"].store
@@ -0,0 +1,83 @@
+from sync4s2m.titlelist import Title, TitleFilter, TitleList, parse_snapshot
+
+import json
+
+
+def make_title(type_: str, id_: int, **fields) -> Title:
+    raw = {
+        "id": id_,
+        "name": f"Title {id_}",
+        "watch_status": "completed",
+        "episodes": 12 if type_ == "anime" else 0,
+        "chapters": 0 if type_ == "anime" else 40,
+        "volumes": 0 if type_ == "anime" else 4,
+        "score": 7,
+        "comment": "",
+        "rewatches": 0,
+        "updated_at": "",
+        **fields,
+    }
+    return Title(type_, raw_title=raw, parse_func=parse_snapshot)
+
+
+def changes(delta: TitleList) -> dict:
+    return {title.get_key(): title.get_modify_type() for title in delta}
+
+
+def test_delta_finds_added_edited_and_removed():
+    this = TitleList(
+        [make_title("anime", 1), make_title("anime", 2, score=9), make_title("manga", 3)]
+    )
+    another = TitleList(
+        [make_title("anime", 2), make_title("manga", 3), make_title("manga", 4)]
+    )
+    delta = this.delta(another)
+    assert changes(delta) == {
+        ("anime", 1): "added",
+        ("anime", 2): "edited",
+        ("manga", 4): "removed",
+    }
+    assert json.loads(delta[("anime", 2)].get_delta()) == {"score": [9, 7]}
+
+
+def test_delta_keeps_anime_and_manga_with_same_id_apart():
+    this = TitleList([make_title("anime", 1), make_title("manga", 1, score=8)])
+    another = TitleList([make_title("anime", 1), make_title("manga", 1)])
+    assert changes(this.delta(another)) == {("manga", 1): "edited"}
+
+
+def test_delta_matches_ranobe_with_manga_of_same_id():
+    this = TitleList([make_title("ranobe", 5), make_title("ranobe", 6, score=10)])
+    another = TitleList([make_title("manga", 5), make_title("manga", 6)])
+    assert changes(this.delta(another)) == {("ranobe", 6): "edited"}
+
+
+def test_delta_applies_filter():
+    this = TitleList([make_title("anime", 1), make_title("manga", 2, score=1)])
+    another = TitleList([make_title("anime", 3), make_title("manga", 2)])
+    assert changes(this.delta(another, TitleFilter(types=["anime"]))) == {
+        ("anime", 1): "added",
+        ("anime", 3): "removed",
+    }
+    assert changes(this.delta(another, TitleFilter(modify=["edited"]))) == {
+        ("manga", 2): "edited",
+    }
+
+
+def test_delta_key_changes_with_other_list():
+    this = TitleList([make_title("anime", 1, score=9)])
+    before = this.delta(TitleList([make_title("anime", 1, score=7)]))
+    after = this.delta(TitleList([make_title("anime", 1, score=8)]))
+    assert before[("anime", 1)].get_delta_key() != after[("anime", 1)].get_delta_key()
+
+
+def test_titles_without_delta_share_no_dict():
+    make_title("anime", 1).get_delta_dict()["score"] = [1, 2]
+    assert make_title("anime", 2).get_delta_dict() == {}
+
+
+def test_delta_finds_edit_behind_fingerprint_collision():
+    this = make_title("anime", 1, score=9)
+    another = make_title("anime", 1)
+    another._fingerprint_ = this.get_fingerprint()
+    assert changes(TitleList([this]).delta(TitleList([another]))) == {("anime", 1): "edited"}